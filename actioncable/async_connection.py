@@ -0,0 +1,287 @@
+"""
+ActionCable connection for asyncio.
+"""
+
+import asyncio
+import logging
+
+import websockets
+
+from . import codec
+from .health import Backoff, ConnectionStats
+
+
+class AsyncConnection:
+    """
+    The connection to a websocket server, run
+    as a task on the event loop rather than a thread.
+    Any number of subscriptions share its one socket.
+    """
+    def __init__(self, url, origin=None, log_ping=False, cookie=None, header=None,
+                 backoff=None):
+        """
+        :param url: The url of the cable server.
+        :param origin: (Optional) The origin.
+        :param log_ping: (Default: False) If true every
+                                            ping gets logged.
+        :param cookie: (Optional) A cookie to send (used for
+                                            authentication for instance).
+        :param header: (Optional) custom header for websocket handshake,
+                                            as a dict or a list of 'Name: value'.
+        :param backoff: (Optional) The Backoff to wait
+                                            between reconnects.
+        """
+        self.url = url
+        self.origin = origin
+        self.log_ping = log_ping
+        self.cookie = cookie
+        self.header = header
+
+        self.logger = logging.getLogger('ActionCable AsyncConnection')
+
+        self.subscriptions = {}
+        # Subscriptions by identifier string, as sent to and echoed by the server.
+        self._subscriptions_by_identifier = {}
+
+        self.websocket = None
+        self.ws_task = None
+
+        self.auto_reconnect = False
+        self.backoff = backoff or Backoff()
+        self.stats = ConnectionStats()
+
+    async def connect(self, origin=None):
+        """
+        Connects to the server, and keeps
+        reconnecting until disconnected.
+
+        :param origin: (Optional) The origin.
+        """
+        self.logger.debug('Establish connection...')
+
+        if self.ws_task is not None and not self.ws_task.done():
+            self.logger.warning('Connection already established. Return...')
+            return
+
+        if origin is not None:
+            self.origin = origin
+
+        self.auto_reconnect = True
+        self.ws_task = asyncio.create_task(self._run_forever())
+
+    async def disconnect(self):
+        """
+        Closes the connection.
+        """
+        self.logger.debug('Close connection...')
+
+        self.auto_reconnect = False
+
+        if self.ws_task is not None:
+            self.ws_task.cancel()
+            try:
+                await self.ws_task
+            except asyncio.CancelledError:
+                pass
+            self.ws_task = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    def _headers(self):
+        headers = []
+        if isinstance(self.header, dict):
+            headers.extend(self.header.items())
+        elif self.header is not None:
+            for line in self.header:
+                name, _, value = line.partition(':')
+                headers.append((name.strip(), value.strip()))
+        if self.cookie is not None:
+            headers.append(('Cookie', self.cookie))
+        return headers
+
+    async def _run_forever(self):
+        while self.auto_reconnect:
+            try:
+                self.logger.debug('Run connection loop.')
+
+                async with websockets.connect(
+                        self.url,
+                        origin=self.origin,
+                        extra_headers=self._headers(),
+                        ping_interval=5,
+                        ping_timeout=3) as websocket:
+                    self.websocket = websocket
+                    self._on_open()
+                    try:
+                        async for message in websocket:
+                            await self._on_message(message)
+                    finally:
+                        self.websocket = None
+                        self._on_close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pylint: disable=broad-except
+                self.logger.error('Connection loop raised exception. Exception: %s', exc)
+                self.stats.last_error = repr(exc)
+
+            if self.auto_reconnect:
+                delay = self.backoff.next_delay()
+                self.stats.reconnect_attempts += 1
+                self.logger.info('Reconnecting in %.1fs.', delay)
+                await asyncio.sleep(delay)
+
+    async def send(self, data):
+        """
+        Sends data to the server.
+        """
+        await self.send_frame(codec.dumps(data))
+
+    async def send_frame(self, frame):
+        """
+        Sends an already encoded frame to the server.
+        """
+        self.logger.debug('Send data: %s', frame)
+
+        if not self.connected:
+            self.logger.warning('Connection not established. Return...')
+            return
+
+        await self.websocket.send(frame)
+        self.stats.frames_sent += 1
+
+    async def send_frames(self, frames):
+        """
+        Sends already encoded frames to the server,
+        one after another.
+        """
+        for frame in frames:
+            await self.send_frame(frame)
+
+    def health(self):
+        """
+        Statistics on the connection and its
+        subscriptions, e.g. for a health check.
+        """
+        health = self.stats.as_dict()
+        health['connected'] = self.connected
+        health['subscriptions'] = {}
+        for subscription in self.subscriptions.values():
+            health['subscriptions'][subscription.state] = health['subscriptions'].get(subscription.state, 0) + 1
+        return health
+
+    def _on_open(self):
+        """
+        Called when the connection is open.
+        """
+        self.logger.debug('Connection established.')
+        self.stats.opened()
+
+    async def _on_message(self, message):
+        """
+        Called aways when a message arrives.
+        """
+        self.stats.received()
+        data = codec.loads(message)
+        message_type = data.get('type')
+        subscription = None
+
+        if 'identifier' in data:
+            identifier = data['identifier']
+            subscription = self._subscriptions_by_identifier.get(identifier)
+            if subscription is None:
+                subscription = self._find_subscription_by_string(identifier)
+
+        if subscription is not None:
+            await subscription.received(data)
+        elif message_type == 'welcome':
+            self.logger.debug('Welcome message received.')
+            self.backoff.reset()
+            await self._resubscribe()
+
+        elif message_type == 'ping':
+            if self.log_ping:
+                self.logger.debug('Ping received.')
+        else:
+            self.logger.warning('Message not supported. (Message: %s)', message)
+
+    def _on_close(self):
+        """
+        Called when the connection was closed.
+        """
+        self.logger.debug('Connection closed.')
+        self.stats.closed()
+
+        for subscription in self.subscriptions.values():
+            if subscription.state in ('subscribed', 'pending'):
+                subscription.state = 'connection_pending'
+
+    async def _resubscribe(self):
+        """
+        Subscribes everything waiting for a connection,
+        in one burst.
+        """
+        pending = [subscription for subscription in self.subscriptions.values()
+                   if subscription.state == 'connection_pending']
+        for subscription in pending:
+            subscription.state = 'pending'
+        await self.send_frames([subscription._subscribe_frame for subscription in pending])
+
+    @property
+    def connected(self):
+        """
+        If connected to server.
+        """
+        return self.websocket is not None and self.websocket.open
+
+    def add_subscription(self, subscription):
+        """
+        Registers a subscription, so that messages
+        for its identifier are routed to it.
+        """
+        self.subscriptions[subscription.uuid] = subscription
+        self._subscriptions_by_identifier.setdefault(
+            subscription._identifier_string(), subscription)
+
+    def remove_subscription(self, subscription):
+        """
+        Stops routing messages to a subscription.
+        """
+        self.subscriptions.pop(subscription.uuid, None)
+        for (identifier, found) in list(self._subscriptions_by_identifier.items()):
+            if found is subscription:
+                del self._subscriptions_by_identifier[identifier]
+        for other in self.subscriptions.values():
+            self._subscriptions_by_identifier.setdefault(other._identifier_string(), other)
+
+    def find_subscription(self, identifier):
+        """
+        Finds a subscription
+        by it's identifier.
+        """
+        subscription = self._subscriptions_by_identifier.get(codec.dumps(identifier))
+        if subscription is not None:
+            return subscription
+
+        for subscription in self.subscriptions.values():
+            if subscription.identifier == identifier:
+                return subscription
+
+    def _find_subscription_by_string(self, identifier):
+        """
+        Finds a subscription by an identifier string
+        not written the way we sent it, e.g. with
+        its keys reordered by the server.
+        """
+        try:
+            subscription = self.find_subscription(codec.loads(identifier))
+        except codec.DecodeError:
+            return None
+
+        if subscription is not None:
+            self._subscriptions_by_identifier[identifier] = subscription
+        return subscription
@@ -0,0 +1,169 @@
+"""
+ActionCable subscription for asyncio.
+"""
+
+import asyncio
+import collections
+import logging
+import uuid
+
+from . import codec
+from .subscription import DROP_OLDEST, DROP_NEWEST
+
+# Put on the queue to end iteration.
+_CLOSED = object()
+
+
+class AsyncSubscription:
+    """
+    A subscription on an AsyncConnection. Received
+    messages are read by iterating over it:
+
+        async for message in subscription:
+            ...
+    """
+    def __init__(self, connection, identifier, max_queue=100, drop=DROP_OLDEST):
+        """
+        :param connection: The connection which is used to subscribe.
+        :param identifier: (Optional) Additional identifier information.
+        :param max_queue: (Default: 100) Most messages to hold
+                                            while waiting to subscribe.
+        :param drop: (Default: DROP_OLDEST) Whether to drop the
+                                            oldest or newest message
+                                            when the queue is full.
+        """
+        self.uuid = str(uuid.uuid1())
+
+        self.connection = connection
+        self.identifier = identifier
+        self._identifier = codec.dumps(identifier)
+        # Frames are encoded once, up to the data sent with messages.
+        self._subscribe_frame = codec.frame(codec.frame_prefix('subscribe', self._identifier))
+        self._unsubscribe_frame = codec.frame(codec.frame_prefix('unsubscribe', self._identifier))
+        self._message_prefix = codec.frame_prefix('message', self._identifier)
+
+        self.state = 'unsubscribed'
+        self.message_queue = collections.deque()
+        self.max_queue = max_queue
+        self.drop = drop
+        self.dropped = 0
+        self._received = asyncio.Queue()
+
+        self.logger = logging.getLogger('ActionCable AsyncSubscription ({})'.format(self.identifier))
+
+        self.connection.add_subscription(self)
+
+    async def create(self):
+        """
+        Subscribes at the server, or once
+        connected if the connection isn't yet.
+        """
+        self.logger.debug('Create subscription on server...')
+
+        if not self.connection.connected:
+            self.state = 'connection_pending'
+            return
+
+        self.state = 'pending'
+        await self.connection.send_frame(self._subscribe_frame)
+
+    async def remove(self):
+        """
+        Removes the subscription, ending
+        iteration over its messages.
+        """
+        self.logger.debug('Remove subscription from server...')
+
+        await self.connection.send_frame(self._unsubscribe_frame)
+        self.connection.remove_subscription(self)
+        self.state = 'unsubscribed'
+        self._received.put_nowait(_CLOSED)
+
+    async def send(self, message):
+        """
+        Sends data to the server on the
+        subscription channel.
+
+        :param data: The JSON data to send.
+        """
+        self.logger.debug('Send message: %s', message)
+
+        if self.state == 'pending' or self.state == 'connection_pending':
+            self.logger.info('Connection not established. Add message to queue.')
+            self._queue(message)
+            return
+        elif self.state == 'unsubscribed' or self.state == 'rejected':
+            self.logger.warning('Not subscribed! Message discarded.')
+            return
+
+        await self.connection.send_frame(codec.frame(self._message_prefix, message.raw_message()))
+
+    async def received(self, data):
+        """
+        API for the connection to forward
+        information to this subscription instance.
+
+        :param data: The JSON data which was received.
+        """
+        self.logger.debug('Data received: %s', data)
+
+        message_type = data.get('type')
+
+        if message_type == 'confirm_subscription':
+            await self._subscribed()
+        elif message_type == 'reject_subscription':
+            self._rejected()
+        elif 'message' in data:
+            self._received.put_nowait(data['message'])
+        else:
+            self.logger.warning('Message type unknown. (%s)', message_type)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._received.get()
+        if message is _CLOSED:
+            # Let any other readers finish too.
+            self._received.put_nowait(_CLOSED)
+            raise StopAsyncIteration
+        return message
+
+    async def _subscribed(self):
+        """
+        Called when the subscription was
+        accepted successfully.
+        """
+        self.logger.debug('Subscription confirmed.')
+        self.state = 'subscribed'
+        message_queue, self.message_queue = self.message_queue, collections.deque()
+        for message in message_queue:
+            await self.send(message)
+
+    def _rejected(self):
+        """
+        Called if the subscription was
+        rejected by the server.
+        """
+        self.logger.warning('Subscription rejected.')
+        self.state = 'rejected'
+        self.message_queue.clear()
+        self._received.put_nowait(_CLOSED)
+
+    def _queue(self, message):
+        """
+        Holds a message until subscribed, dropping
+        one if the queue is full.
+        """
+        if len(self.message_queue) >= self.max_queue:
+            self.dropped += 1
+            self.connection.stats.dropped += 1
+            if self.drop == DROP_NEWEST:
+                self.logger.warning('Message queue full. Message discarded.')
+                return
+            self.logger.warning('Message queue full. Oldest message discarded.')
+            self.message_queue.popleft()
+        self.message_queue.append(message)
+
+    def _identifier_string(self):
+        return self._identifier
@@ -0,0 +1,98 @@
+"""
+JSON encoding and decoding for ActionCable frames.
+
+Uses orjson or msgspec when one is installed, and the standard library
+otherwise. Set ACTIONCABLE_JSON to json, orjson or msgspec to choose.
+Call through the module (codec.loads, codec.dumps) so that use() applies.
+"""
+
+import collections
+import json
+import os
+
+Codec = collections.namedtuple('Codec', ['name', 'loads', 'dumps', 'DecodeError'])
+
+# In order of preference.
+PREFERENCE = ('orjson', 'msgspec', 'json')
+
+
+def _json():
+    return Codec('json', json.loads, json.dumps, json.JSONDecodeError)
+
+
+def _orjson():
+    import orjson  # pylint: disable=import-outside-toplevel
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+
+    return Codec('orjson', orjson.loads, dumps, orjson.JSONDecodeError)
+
+
+def _msgspec():
+    import msgspec  # pylint: disable=import-outside-toplevel
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj):
+        return encoder.encode(obj).decode('utf-8')
+
+    return Codec('msgspec', decoder.decode, dumps, msgspec.DecodeError)
+
+
+CODECS = {
+    'json': _json,
+    'orjson': _orjson,
+    'msgspec': _msgspec,
+}
+
+
+def load(name=None):
+    """
+    The named codec, or the first of PREFERENCE
+    that's installed.
+
+    :param name: (Optional) json, orjson or msgspec.
+    """
+    if name:
+        return CODECS[name]()
+
+    for name in PREFERENCE:
+        try:
+            return CODECS[name]()
+        except ImportError:
+            continue
+
+
+def use(name=None):
+    """
+    Switches codec.
+
+    :param name: (Optional) json, orjson or msgspec.
+    """
+    global NAME, loads, dumps, DecodeError  # pylint: disable=global-statement
+    NAME, loads, dumps, DecodeError = load(name)
+
+
+NAME = loads = dumps = DecodeError = None
+use(os.environ.get('ACTIONCABLE_JSON'))
+
+
+def frame_prefix(command, identifier):
+    """
+    The start of a frame for a command on a subscription,
+    up to where its data would go, to be completed with
+    frame(). Both parts are JSON encoded.
+    """
+    return '{{"command":{},"identifier":{}'.format(dumps(command), dumps(identifier))
+
+
+def frame(prefix, data=None):
+    """
+    Completes a frame begun by frame_prefix(). As ActionCable
+    expects, data is a string of already-encoded JSON.
+    """
+    if data is None:
+        return prefix + '}'
+    return prefix + ',"data":' + dumps(data) + '}'
@@ -4,16 +4,19 @@ ActionCable connection.
 
 import threading
 import uuid
-import json
 import logging
-import time
 import websocket
 
+from . import codec
+from .health import Backoff, ConnectionStats
+from .writer import OutboundWriter
+
 class Connection:
     """
     The connection to a websocket server
     """
-    def __init__(self, url, origin=None, log_ping=False, cookie=None, header=None):
+    def __init__(self, url, origin=None, log_ping=False, cookie=None, header=None,
+                 backoff=None, flush_interval=0.005):
         """
         :param url: The url of the cable server.
         :param origin: (Optional) The origin.
@@ -22,6 +25,11 @@ class Connection:
         :param cookie: (Optional) A cookie to send (used for
                                             authentication for instance).
         :param header: (Optional) custom header for websocket handshake.
+        :param backoff: (Optional) The Backoff to wait
+                                            between reconnects.
+        :param flush_interval: (Default: 0.005) Seconds to collect
+                                            frames for before writing
+                                            them together.
         """
         self.url = url
         self.origin = origin
@@ -32,11 +40,18 @@ class Connection:
         self.logger = logging.getLogger('ActionCable Connection')
 
         self.subscriptions = {}
+        # Subscriptions by identifier string, as sent to and echoed by the server.
+        self._subscriptions_by_identifier = {}
 
         self.websocket = None
         self.ws_thread = None
 
         self.auto_reconnect = False
+        self.backoff = backoff or Backoff()
+        self.stats = ConnectionStats()
+        self.writer = OutboundWriter(self, flush_interval)
+        # Set to cut short the wait before reconnecting.
+        self._stopping = threading.Event()
 
         if origin is not None:
             self.origin = origin
@@ -57,6 +72,8 @@ class Connection:
             self.origin = origin
 
         self.auto_reconnect = True
+        self._stopping.clear()
+        self.writer.start()
 
         self.ws_thread = threading.Thread(
             name="APIConnectionThread_{}".format(uuid.uuid1()),
@@ -71,6 +88,9 @@ class Connection:
         self.logger.debug('Close connection...')
 
         self.auto_reconnect = False
+        self._stopping.set()
+        # Write anything already sent before closing.
+        self.writer.stop()
 
         if self.websocket is not None:
             self.websocket.close()
@@ -85,40 +105,84 @@ class Connection:
                     cookie=self.cookie,
                     header=self.header,
                     on_message=lambda socket, message: self._on_message(socket, message),
-                    on_close=lambda socket: self._on_close(socket)
+                    on_error=lambda socket, error: self._on_error(socket, error),
+                    # Also passed the close status code and reason.
+                    on_close=lambda socket, *args: self._on_close(socket)
                 )
                 self.websocket.on_open = lambda socket: self._on_open(socket)
 
                 self.websocket.run_forever(ping_interval=5, ping_timeout=3, origin=self.origin)
-
-                time.sleep(2)
             except Exception as exc:
                 self.logger.error('Connection loop raised exception. Exception: %s', exc)
+                self.stats.last_error = repr(exc)
+
+            if self.auto_reconnect:
+                delay = self.backoff.next_delay()
+                self.stats.reconnect_attempts += 1
+                self.logger.info('Reconnecting in %.1fs.', delay)
+                self._stopping.wait(delay)
 
     def send(self, data):
         """
         Sends data to the server.
         """
-        self.logger.debug('Send data: {}'.format(data))
+        self.send_frame(codec.dumps(data))
+
+    def send_frame(self, frame):
+        """
+        Sends an already encoded frame to the server.
+        It's queued for the writer thread, which may
+        write it together with others.
+        """
+        self.logger.debug('Send data: %s', frame)
 
         if not self.connected:
             self.logger.warning('Connection not established. Return...')
             return
 
-        self.websocket.send(json.dumps(data))
+        self.writer.put(frame)
+
+    def send_frames(self, frames):
+        """
+        Sends already encoded frames to the server,
+        one after another.
+        """
+        for frame in frames:
+            self.send_frame(frame)
+
+    def health(self):
+        """
+        Statistics on the connection and its
+        subscriptions, e.g. for a health check.
+        """
+        health = self.stats.as_dict()
+        health['connected'] = self.connected
+        health['subscriptions'] = {}
+        for subscription in list(self.subscriptions.values()):
+            health['subscriptions'][subscription.state] = health['subscriptions'].get(subscription.state, 0) + 1
+        return health
 
     def _on_open(self, socket):
         """
         Called when the connection is open.
         """
         self.logger.debug('Connection established.')
+        self.stats.opened()
+
+    def _on_error(self, socket, error):
+        """
+        Called when the connection raises an error.
+        """
+        self.logger.debug('Connection error: %s', error)
+        self.stats.last_error = repr(error)
 
 
     def _on_message(self, socket, message):
         """
         Called aways when a message arrives.
         """
-        data = json.loads(message)
+        self.stats.received()
+        data = codec.loads(message)
         message_type = None
         identifier = None
         subscription = None
@@ -127,19 +191,17 @@ class Connection:
             message_type = data['type']
 
         if 'identifier' in data:
-            identifier = json.loads(data['identifier'])
-
-        if identifier is not None:
-            subscription = self.find_subscription(identifier)
+            identifier = data['identifier']
+            subscription = self._subscriptions_by_identifier.get(identifier)
+            if subscription is None:
+                subscription = self._find_subscription_by_string(identifier)
 
         if subscription is not None:
             subscription.received(data)
         elif message_type == 'welcome':
             self.logger.debug('Welcome message received.')
-
-            for subscription in self.subscriptions.values():
-                if subscription.state == 'connection_pending':
-                    subscription.create()
+            self.backoff.reset()
+            self._resubscribe()
 
         elif message_type == 'ping':
             if self.log_ping:
@@ -152,11 +214,23 @@ class Connection:
         Called when the connection was closed.
         """
         self.logger.debug('Connection closed.')
+        self.stats.closed()
 
         for subscription in self.subscriptions.values():
-            if subscription.state == 'subscribed':
+            if subscription.state in ('subscribed', 'pending'):
                 subscription.state = 'connection_pending'
 
+    def _resubscribe(self):
+        """
+        Subscribes everything waiting for a connection,
+        in one burst.
+        """
+        pending = [subscription for subscription in list(self.subscriptions.values())
+                   if subscription.state == 'connection_pending']
+        for subscription in pending:
+            subscription.state = 'pending'
+        self.send_frames([subscription._subscribe_frame for subscription in pending])
+
     @property
     def socket_present(self):
         """
@@ -173,11 +247,39 @@ class Connection:
                self.websocket.sock is not None and \
                self.websocket.sock.connected
 
+    def add_subscription(self, subscription):
+        """
+        Registers a subscription, so that messages
+        for its identifier are routed to it.
+        """
+        self.subscriptions[subscription.uuid] = subscription
+        self._subscriptions_by_identifier.setdefault(
+            subscription._identifier_string(), subscription)
+
     def find_subscription(self, identifier):
         """
         Finds a subscription
         by it's identifier.
         """
+        subscription = self._subscriptions_by_identifier.get(codec.dumps(identifier))
+        if subscription is not None:
+            return subscription
+
         for subscription in self.subscriptions.values():
             if subscription.identifier == identifier:
                 return subscription
+
+    def _find_subscription_by_string(self, identifier):
+        """
+        Finds a subscription by an identifier string
+        not written the way we sent it, e.g. with
+        its keys reordered by the server.
+        """
+        try:
+            subscription = self.find_subscription(codec.loads(identifier))
+        except codec.DecodeError:
+            return None
+
+        if subscription is not None:
+            self._subscriptions_by_identifier[identifier] = subscription
+        return subscription
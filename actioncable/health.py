@@ -0,0 +1,84 @@
+"""
+ActionCable connection health: reconnect backoff and statistics.
+"""
+
+import random
+import time
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter, so that
+    clients dropped together don't reconnect together.
+    """
+    def __init__(self, base=1, maximum=30, rng=None):
+        """
+        :param base: (Default: 1) Most seconds to wait
+                                            before the first retry.
+        :param maximum: (Default: 30) Most seconds to wait
+                                            before any retry.
+        :param rng: (Optional) A random.Random to draw delays from.
+        """
+        self.base = base
+        self.maximum = maximum
+        self.rng = rng or random.Random()
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        Seconds to wait before the next attempt.
+        """
+        self.attempts += 1
+        ceiling = min(self.maximum, self.base * 2 ** (self.attempts - 1))
+        return self.rng.uniform(0, ceiling)
+
+    def reset(self):
+        """
+        Called once a connection succeeds.
+        """
+        self.attempts = 0
+
+
+class ConnectionStats:
+    """
+    Counts what happened on a connection, across reconnects.
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.connects = 0
+        self.disconnects = 0
+        self.reconnect_attempts = 0
+        self.messages_received = 0
+        self.frames_sent = 0
+        self.writes = 0
+        self.dropped = 0
+        self.last_error = None
+        self.connected_at = None
+        self.last_message_at = None
+
+    def opened(self):
+        self.connects += 1
+        self.connected_at = self.clock()
+
+    def closed(self):
+        self.disconnects += 1
+        self.connected_at = None
+
+    def received(self):
+        self.messages_received += 1
+        self.last_message_at = self.clock()
+
+    def as_dict(self):
+        now = self.clock()
+        return {
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'reconnect_attempts': self.reconnect_attempts,
+            'messages_received': self.messages_received,
+            'frames_sent': self.frames_sent,
+            'writes': self.writes,
+            'dropped': self.dropped,
+            'last_error': self.last_error,
+            'uptime': None if self.connected_at is None else now - self.connected_at,
+            'idle': None if self.last_message_at is None else now - self.last_message_at,
+        }
@@ -2,7 +2,7 @@
 ActionCable message
 """
 
-import json
+from . import codec
 
 
 class Message:
@@ -27,4 +27,4 @@ class Message:
         The message formatted
         and dumped.
         """
-        return json.dumps(self.message())
+        return codec.dumps(self.message())
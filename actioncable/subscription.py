@@ -2,33 +2,53 @@
 ActionCable subscription.
 """
 
+import collections
 import uuid
-import json
 import logging
 
+from . import codec
+
+
+# What a subscription does with a message sent while its buffer is full.
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
 
 class Subscription:
     """
     Subscriptions on a server.
     """
-    def __init__(self, connection, identifier):
+    def __init__(self, connection, identifier, max_queue=100, drop=DROP_OLDEST):
         """
         :param connection: The connection which is used to subscribe.
         :param identifier: (Optional) Additional identifier information.
+        :param max_queue: (Default: 100) Most messages to hold
+                                            while waiting to subscribe.
+        :param drop: (Default: DROP_OLDEST) Whether to drop the
+                                            oldest or newest message
+                                            when the queue is full.
         """
         self.uuid = str(uuid.uuid1())
 
         self.connection = connection
         self.identifier = identifier
-        
+        self._identifier = codec.dumps(identifier)
+        # Frames are encoded once, up to the data sent with messages.
+        self._subscribe_frame = codec.frame(codec.frame_prefix('subscribe', self._identifier))
+        self._unsubscribe_frame = codec.frame(codec.frame_prefix('unsubscribe', self._identifier))
+        self._message_prefix = codec.frame_prefix('message', self._identifier)
+
         self.receive_callback = None
 
         self.state = 'unsubcribed'
-        self.message_queue = []
+        self.message_queue = collections.deque()
+        self.max_queue = max_queue
+        self.drop = drop
+        self.dropped = 0
 
         self.logger = logging.getLogger('ActionCable Subscription ({})'.format(self.identifier))
 
-        self.connection.subscriptions[self.uuid] = self
+        self.connection.add_subscription(self)
 
     def create(self):
         """
@@ -40,12 +60,7 @@ class Subscription:
             self.state = 'connection_pending'
             return
 
-        data = {
-            'command': 'subscribe',
-            'identifier': self._identifier_string()
-        }
-
-        self.connection.send(data)
+        self.connection.send_frame(self._subscribe_frame)
         self.state = 'pending'
 
     def remove(self):
@@ -54,12 +69,7 @@ class Subscription:
         """
         self.logger.debug('Remove subscription from server...')
 
-        data = {
-            'command': 'unsubscribe',
-            'identifier': self._identifier_string()
-        }
-
-        self.connection.send(data)
+        self.connection.send_frame(self._unsubscribe_frame)
         self.state = 'unsubscribed'
 
     def send(self, message):
@@ -73,19 +83,13 @@ class Subscription:
 
         if self.state == 'pending' or self.state == 'connection_pending':
             self.logger.info('Connection not established. Add message to queue.')
-            self.message_queue.append(message)
+            self._queue(message)
             return
         elif self.state == 'unsubscribed' or self.state == 'rejected':
             self.logger.warning('Not subscribed! Message discarded.')
             return
 
-        data = {
-            'command': 'message',
-            'identifier': self._identifier_string(),
-            'data': message.raw_message()
-        }
-
-        self.connection.send(data)
+        self.connection.send_frame(codec.frame(self._message_prefix, message.raw_message()))
 
     def on_receive(self, callback):
         """
@@ -106,7 +110,7 @@ class Subscription:
         :param data: The JSON data which was received.
         :type data: Message
         """
-        self.logger.debug('Data received: {}'.format(data))
+        self.logger.debug('Data received: %s', data)
 
         message_type = None
 
@@ -129,7 +133,8 @@ class Subscription:
         """
         self.logger.debug('Subscription confirmed.')
         self.state = 'subscribed'
-        for message in self.message_queue:
+        message_queue, self.message_queue = self.message_queue, collections.deque()
+        for message in message_queue:
             self.send(message)
 
     def _rejected(self):
@@ -139,7 +144,22 @@ class Subscription:
         """
         self.logger.warning('Subscription rejected.')
         self.state = 'rejected'
-        self.message_queue = []
+        self.message_queue.clear()
+
+    def _queue(self, message):
+        """
+        Holds a message until subscribed, dropping
+        one if the queue is full.
+        """
+        if len(self.message_queue) >= self.max_queue:
+            self.dropped += 1
+            self.connection.stats.dropped += 1
+            if self.drop == DROP_NEWEST:
+                self.logger.warning('Message queue full. Message discarded.')
+                return
+            self.logger.warning('Message queue full. Oldest message discarded.')
+            self.message_queue.popleft()
+        self.message_queue.append(message)
 
     def _identifier_string(self):
-        return json.dumps(self.identifier)
+        return self._identifier
@@ -0,0 +1,125 @@
+"""
+ActionCable outbound writer.
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+
+import websocket
+
+# Put on the queue to stop the writer.
+_STOP = object()
+
+
+class OutboundWriter:
+    """
+    Writes frames to a Connection's socket from its own
+    thread. Callers on any thread only append to a queue,
+    and never wait on the socket. Frames queued within
+    flush_interval of the first waiting frame, and any
+    more waiting by then, are written together in one
+    call to the socket.
+    """
+    def __init__(self, connection, flush_interval=0.005, max_bytes=64 * 1024):
+        """
+        :param connection: The connection to write to.
+        :param flush_interval: (Default: 0.005) Seconds to wait
+                                            for more frames before writing.
+        :param max_bytes: (Default: 64KB) Write as soon as
+                                            this much is waiting.
+        """
+        self.connection = connection
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+
+        self.logger = logging.getLogger('ActionCable OutboundWriter')
+
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the writer thread.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.thread = threading.Thread(
+            name="APIWriterThread_{}".format(uuid.uuid1()),
+            target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Writes whatever is queued, then stops the writer thread.
+        """
+        if self.thread is None:
+            return
+
+        self.queue.put(_STOP)
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def put(self, frame):
+        """
+        Queues an encoded frame to be written.
+        """
+        self.queue.put(frame)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            frame = self.queue.get()
+            if frame is _STOP:
+                return
+
+            batch = [frame]
+            size = len(frame)
+            # Collect frames queued within flush_interval of the first,
+            # and any more already waiting after that.
+            flush_at = time.monotonic() + self.flush_interval
+            while size < self.max_bytes:
+                try:
+                    timeout = flush_at - time.monotonic()
+                    if timeout > 0:
+                        frame = self.queue.get(timeout=timeout)
+                    else:
+                        frame = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is _STOP:
+                    stopping = True
+                    break
+                batch.append(frame)
+                size += len(frame)
+
+            self._write(batch)
+
+    def _write(self, batch):
+        """
+        Writes a batch of frames in one go,
+        taking the socket's lock once.
+        """
+        data = b''.join(
+            websocket.ABNF.create_frame(frame, websocket.ABNF.OPCODE_TEXT).format()
+            for frame in batch)
+
+        socket = self.connection.websocket and self.connection.websocket.sock
+        try:
+            if socket is None or not socket.connected:
+                raise websocket.WebSocketConnectionClosedException('Not connected.')
+            with socket.lock:
+                socket.sock.sendall(data)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.warning('Failed to write %d frames: %s', len(batch), exc)
+            self.connection.stats.dropped += len(batch)
+            self.connection.stats.last_error = repr(exc)
+            return
+
+        self.connection.stats.writes += 1
+        self.connection.stats.frames_sent += len(batch)
@@ -1,17 +1,31 @@
 import os
 import traceback
-import json
 import asyncio
+import logging
 import aiohttp
+import rctogether
 import websockets
 
+import flowcontrol
+import ingest
+import logs
+import metrics
+import ratelimit
+import retry
+from actioncable import codec
+
 RC_APP_ID = os.environ["RC_APP_ID"]
 RC_APP_SECRET = os.environ["RC_APP_SECRET"]
 RC_APP_ENDPOINT = os.environ.get("RC_ENDPOINT", "recurse.rctogether.com")
 
+logger = logging.getLogger(__name__)
+
 
-class HttpError(Exception):
-    pass
+class HttpError(rctogether.api.HttpError):
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(status, body)
+        # Seconds the server asked us to wait before trying again, if it said.
+        self.retry_after = retry_after
 
 
 def api_url(resource, resource_id=None):
@@ -24,57 +38,131 @@ def api_url(resource, resource_id=None):
 async def parse_response(response):
     if response.status != 200:
         body = await response.text()
-        raise HttpError(response.status, body)
+        retry_after = retry.parse_retry_after(response.headers.get("Retry-After"))
+        raise HttpError(response.status, body, retry_after)
     return await response.json()
 
 
-async def get_bots():
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url=api_url("bots")) as response:
-            return await parse_response(response)
+# Connection pool settings for the shared client. Keeping connections alive
+# means a burst of bot moves reuses a handful of TLS connections rather than
+# paying a fresh handshake per request.
+LIMIT_PER_HOST = int(os.environ.get("RC_LIMIT_PER_HOST", 10))
+DNS_CACHE_SECONDS = 300
+KEEPALIVE_SECONDS = 30
+
+
+class ApiClient:
+    """
+    A long-lived, connection-pooled HTTP client for the RC Together API.
+
+    The underlying aiohttp session is created lazily on first use (it needs a
+    running event loop) and reopened if it has been closed.
+    """
+
+    def __init__(
+        self,
+        limit_per_host=LIMIT_PER_HOST,
+        dns_cache_seconds=DNS_CACHE_SECONDS,
+        keepalive_seconds=KEEPALIVE_SECONDS,
+    ):
+        self.limit_per_host = limit_per_host
+        self.dns_cache_seconds = dns_cache_seconds
+        self.keepalive_seconds = keepalive_seconds
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_seconds,
+                keepalive_timeout=self.keepalive_seconds,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def request(self, method, resource, resource_id=None, **kwargs):
+        url = api_url(resource, resource_id)
+        # Every request goes through flowcontrol, which holds it back while the
+        # server is slow or failing.
+        with metrics.HTTP_LATENCY.labels(method, resource).time():
+            async with flowcontrol.request(), self.session.request(
+                method, url, **kwargs
+            ) as response:
+                return await parse_response(response)
+
+    async def get(self, resource):
+        return await self.request("GET", resource)
+
+    async def delete(self, resource, resource_id):
+        await ratelimit.acquire(resource)
+        return await self.request("DELETE", resource, resource_id)
+
+    async def post(self, resource, json):
+        await ratelimit.acquire(resource)
+        return await self.request("POST", resource, json=json)
 
+    async def patch(self, resource, resource_id, json):
+        await ratelimit.acquire(resource)
+        return await self.request("PATCH", resource, resource_id, json=json)
 
-async def delete_bot(bot_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.delete(url=api_url("bots", bot_id)) as response:
-            return await parse_response(response)
 
+# Shared by the module level helpers, Bot and RcTogether unless they are given
+# their own client.
+default_client = ApiClient()
+# A function returning the entities RcTogether should process, used in place
+# of the RC Together websocket when set (by the simulator, for instance).
+default_source = None
 
-async def create_bot(name, emoji, x=5, y=2, direction="right", can_be_mentioned=False):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            api_url("bots"),
-            json={
-                "bot": {
-                    "name": name,
-                    "emoji": emoji,
-                    "x": x,
-                    "y": y,
-                    "direction": direction,
-                    "can_be_mentioned": can_be_mentioned,
-                }
-            },
-        ) as response:
-            return await parse_response(response)
 
+async def get_bots(client=None):
+    return await (client or default_client).get("bots")
 
-async def update_bot(bot_id, bot_attributes):
-    async with aiohttp.ClientSession() as session:
-        async with session.patch(api_url("bots", bot_id), json={"bot": bot_attributes}) as response:
-            return await parse_response(response)
 
+async def delete_bot(bot_id, client=None):
+    return await (client or default_client).delete("bots", bot_id)
 
-async def send_message(bot_id, message_text):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url=api_url("messages"), json={"bot_id": bot_id, "text": message_text}
-        ) as response:
-            return await parse_response(response)
 
+async def create_bot(name, emoji, x=5, y=2, direction="right", can_be_mentioned=False, client=None):
+    return await (client or default_client).post(
+        "bots",
+        json={
+            "bot": {
+                "name": name,
+                "emoji": emoji,
+                "x": x,
+                "y": y,
+                "direction": direction,
+                "can_be_mentioned": can_be_mentioned,
+            }
+        },
+    )
 
-async def clean_up_bots():
-    bots = await get_bots()
-    asyncio.gather(*[delete_bot(bot["id"]) for bot in bots])
+
+async def update_bot(bot_id, bot_attributes, client=None):
+    return await (client or default_client).patch("bots", bot_id, json={"bot": bot_attributes})
+
+
+async def send_message(bot_id, message_text, client=None):
+    return await (client or default_client).post(
+        "messages", json={"bot_id": bot_id, "text": message_text}
+    )
+
+
+async def clean_up_bots(client=None):
+    bots = await get_bots(client)
+    asyncio.gather(*[delete_bot(bot["id"], client) for bot in bots])
 
 
 def with_tracebacks(f):
@@ -89,17 +177,23 @@ def with_tracebacks(f):
 
 
 class Bot:
-    def __init__(self, bot_json, handle_update=None):
+    def __init__(self, bot_json, handle_update=None, client=None):
         self.bot_json = bot_json
         self.queue = asyncio.Queue()
         self.handle_update = handle_update
+        self.client = client or default_client
+        # An update that failed and is waiting to be retried.
+        self.retry_update = None
+        self.failed_attempts = 0
 
     @classmethod
-    async def create(cls, name, emoji, x, y, handle_update=None, can_be_mentioned=False):
+    async def create(
+        cls, name, emoji, x, y, handle_update=None, can_be_mentioned=False, client=None
+    ):
         bot_json = await create_bot(
-            name=name, emoji=emoji, x=x, y=y, can_be_mentioned=can_be_mentioned
+            name=name, emoji=emoji, x=x, y=y, can_be_mentioned=can_be_mentioned, client=client
         )
-        bot = cls(bot_json, handle_update)
+        bot = cls(bot_json, handle_update, client)
         asyncio.create_task(bot.run())
         return bot
 
@@ -116,26 +210,48 @@ class Bot:
         return self.bot_json["name"]
 
     async def run(self):
+        loop = asyncio.get_running_loop()
+
         while True:
-            update = await self.queue.get()
-            while not self.queue.empty():
-                print("Skipping outdated update: ", update)
+            if self.retry_update is not None:
+                update, self.retry_update = self.retry_update, None
+            else:
                 update = await self.queue.get()
-            print("Applying update: ", update)
+            while not self.queue.empty():
+                # Later fields win, but nothing queued is lost. A retried
+                # update is overridden by anything queued since it failed.
+                update = {**update, **await self.queue.get()}
+                metrics.UPDATES.labels("coalesced", "arctogether.Bot").inc()
+            logger.debug("Applying update: %s", update, extra=logs.SAMPLED)
+            # update_bot waits for the shared rate limiter; the pause between
+            # this bot's updates counts from when the request goes out.
+            next_update_at = loop.time() + 1
             try:
-                await update_bot(self.id, update)
-            except HttpError as exc:
-                print(f"Update failed: {self!r}, {exc!r}")
-            await asyncio.sleep(1)
+                await update_bot(self.id, update, self.client)
+                self.failed_attempts = 0
+                metrics.UPDATES.labels("sent", "arctogether.Bot").inc()
+            except retry.ERRORS as exc:
+                metrics.UPDATES.labels("failed", "arctogether.Bot").inc()
+                self.failed_attempts += 1
+                retry_in = retry.default_policy.delay(exc, self.failed_attempts)
+                if retry_in is None:
+                    self.failed_attempts = 0
+                    logger.warning("Update failed: %r, %r", self, exc)
+                else:
+                    logger.info("Update failed, retrying in %.1fs: %r, %r", retry_in, self, exc)
+                    self.retry_update = update
+                    next_update_at = max(next_update_at, loop.time() + retry_in)
+            await asyncio.sleep(next_update_at - loop.time())
 
     async def update(self, update):
+        metrics.UPDATES.labels("enqueued", "arctogether.Bot").inc()
         await self.queue.put(update)
 
     def update_data(self, data):
         self.bot_json = data
 
     async def handle_entity(self, entity):
-        print("Bot update!")
+        logger.debug("Bot update: %s", entity, extra=logs.SAMPLED)
         self.bot_json = entity
         if self.handle_update:
             await self.handle_update(entity)
@@ -145,29 +261,58 @@ class Bot:
 
 
 class RcTogether:
-    def __init__(self, callbacks=()):
+    def __init__(
+        self, callbacks=(), client=None, batch_callbacks=(), queue=None, workers=1, source=None
+    ):
         self.callbacks = callbacks
+        # Called with a list of entities at a time, e.g. a whole world snapshot.
+        self.batch_callbacks = batch_callbacks
         self.bots = {}
+        self.client = client or default_client
+        # Entities read from the websocket wait here to be handled.
+        self.queue = queue
+        self.workers = workers
+        self.source = source or default_source
 
     async def run_websocket(self):
+        """
+        Process websocket messages until the connection closes. The shared HTTP
+        client lives as long as the websocket, and is closed when it ends.
+
+        The websocket is read by its own task, so slow callbacks don't hold up
+        reading (or answering pings); entities queue up in self.queue.
+        """
+        if self.queue is None:
+            self.queue = ingest.EntityQueue()
+
+        entities = self.source() if self.source else self.entities()
+        try:
+            await ingest.process(
+                entities, self.handle_entities, queue=self.queue, workers=self.workers
+            )
+        finally:
+            await self.client.close()
+
+    async def entities(self):
         origin = f"https://{RC_APP_ENDPOINT}"
         url = f"wss://{RC_APP_ENDPOINT}/cable?app_id={RC_APP_ID}&app_secret={RC_APP_SECRET}"
 
         async with websockets.connect(url, ssl=True, origin=origin) as connection:
-            subscription_identifier = json.dumps({"channel": "ApiChannel"})
+            subscription_identifier = codec.dumps({"channel": "ApiChannel"})
             async for msg in connection:
-                data = json.loads(msg)
+                data = codec.loads(msg)
 
                 message_type = data.get("type")
+                metrics.WEBSOCKET_MESSAGES.labels(message_type).inc()
 
                 if message_type == "ping":
                     pass
                 elif message_type == "welcome":
                     await connection.send(
-                        json.dumps({"command": "subscribe", "identifier": subscription_identifier})
+                        codec.frame(codec.frame_prefix("subscribe", subscription_identifier))
                     )
                 elif message_type == "confirm_subscription":
-                    print("Subscription confirmed.")
+                    logger.info("Subscription confirmed.")
                 elif message_type == "reject_subscription":
                     raise ValueError("RcTogether: Subscription rejected.")
                 elif (
@@ -175,30 +320,41 @@ class RcTogether:
                     and data["identifier"] == subscription_identifier
                     and "message" in data
                 ):
-                    await self.handle_message(data["message"])
+                    message = data["message"]
+                    if message["type"] == "world":
+                        for entity in message["payload"]["entities"]:
+                            yield entity
+                    else:
+                        yield message["payload"]
                 else:
-                    print("Unknown message type: ", message_type)
+                    logger.warning("Unknown message type: %s", message_type)
 
     async def create_bot(self, name, emoji, x, y, handle_update, can_be_mentioned=False):
-        bot = await Bot.create(name, emoji, x, y, handle_update, can_be_mentioned)
+        bot = await Bot.create(name, emoji, x, y, handle_update, can_be_mentioned, self.client)
         self.bots[bot.id] = bot
         return bot
 
     async def handle_message(self, message):
         if message["type"] == "world":
-            for entity in message["payload"]["entities"]:
-                await self.handle_entity(entity)
+            await self.handle_entities(message["payload"]["entities"])
         else:
             await self.handle_entity(message["payload"])
 
     async def handle_entity(self, entity):
-        for callback in self.callbacks:
-            await callback(entity)
+        await self.handle_entities([entity])
+
+    async def handle_entities(self, entities):
+        for callback in self.batch_callbacks:
+            await callback(entities)
 
-        if entity["id"] in self.bots:
-            callback = self.bots[entity["id"]].handle_entity
-            if callback:
+        for entity in entities:
+            for callback in self.callbacks:
                 await callback(entity)
 
+            if entity["id"] in self.bots:
+                callback = self.bots[entity["id"]].handle_entity
+                if callback:
+                    await callback(entity)
+
     def add_callback(self, callback):
         self.callbacks.append(callback)
@@ -0,0 +1,194 @@
+"""
+Compare the concurrency models in demos/ at creating many bots.
+
+Each demo runs as a subprocess against a local stand-in for the RC Together
+API, which answers every request after a configurable latency. For each
+model and number of snakes we report:
+
+    wall       seconds from starting the demo until it exits
+    peak_rss   the demo's peak memory (from os.wait4)
+    conns      TCP connections the demo opened to the server
+    peak_open  the most connections it had open at once
+
+Demos whose dependencies (requests, eventlet) aren't installed are skipped.
+
+    python benchmarks/bench_concurrency.py [--counts 10 100 1000] [--latency 0.1]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+DEMOS_DIR = os.path.join(os.path.dirname(__file__), "..", "demos")
+DEMOS = {
+    "sequential": "demo.py",
+    "threads": "demo-threads.py",
+    "eventlet": "demo-eventlet.py",
+    "asyncio": "demo-async.py",
+}
+COUNTS = (10, 100, 1000)
+LATENCY = 0.1
+TIMEOUT = 600
+
+
+class StandInServer:
+    """
+    A minimal HTTP/1.1 server, run on its own thread, that answers any
+    request with a bot after a delay, and counts connections.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.port = None
+        self.connections = 0
+        self.open_connections = 0
+        self.peak_open = 0
+        self.requests = 0
+        self._loop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def reset(self):
+        self.connections = self.peak_open = self.requests = 0
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=4096)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        server.close()
+        self._loop.close()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.open_connections += 1
+        self.peak_open = max(self.peak_open, self.open_connections)
+        try:
+            while await self._respond(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+    async def _respond(self, reader, writer):
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+        bot = json.loads(body).get("bot", {}) if body else {}
+        payload = json.dumps({"id": self.requests, **bot}).encode()
+        keep_alive = headers.get("connection", "").lower() != "close"
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/json\r\n"
+            + f"Content-Length: {len(payload)}\r\n".encode()
+            + (b"" if keep_alive else b"Connection: close\r\n")
+            + b"\r\n"
+            + payload
+        )
+        await writer.drain()
+        return keep_alive
+
+
+def run_demo(demo, count, server):
+    env = dict(
+        os.environ,
+        RC_APP_ID="benchmark",
+        RC_APP_SECRET="benchmark",
+        RC_ENDPOINT=f"127.0.0.1:{server.port}",
+        RC_SCHEME="http",
+        SNAKES=str(count),
+    )
+    server.reset()
+
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(DEMOS_DIR, DEMOS[demo])],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    # Read stderr on a thread so a chatty demo can't block on a full pipe.
+    errors = []
+    reader = threading.Thread(target=lambda: errors.append(process.stderr.read()))
+    reader.start()
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started_at
+    reader.join()
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode:
+        stderr = errors[0].decode(errors="replace")
+        if "ModuleNotFoundError" in stderr:
+            return {"skipped": stderr.strip().splitlines()[-1]}
+        raise RuntimeError(f"{demo} failed:\n{stderr}")
+
+    return {
+        "wall": wall,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": rusage.ru_maxrss / 1024,
+        "conns": server.connections,
+        "peak_open": server.peak_open,
+        "requests": server.requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("demos", nargs="*", default=list(DEMOS))
+    parser.add_argument("--counts", type=int, nargs="+", default=COUNTS)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency)
+    server.start()
+    try:
+        for demo in args.demos:
+            for count in args.counts:
+                result = run_demo(demo, count, server)
+                label = f"{demo}/{count}"
+                if "skipped" in result:
+                    print(f"{label:<18} skipped: {result['skipped']}")
+                    break
+                print(
+                    f"{label:<18} wall={result['wall']:.2f}s"
+                    f"  peak_rss={result['peak_rss_mb']:.1f}MB"
+                    f"  conns={result['conns']}  peak_open={result['peak_open']}"
+                    f"  requests={result['requests']}"
+                )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for choosing an Agency command from a chat message.
+
+Compares the compiled CommandDispatcher against searching each pattern in
+turn with re.search, as handle_mention used to.
+
+    python benchmarks/bench_dispatch.py [--number N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pets  # noqa: E402
+
+CORPUS = [
+    "@**Pet Agency Genie** adopt the cat, please!",
+    "@**Pet Agency Genie** Could you adopt a unicorn for me, s'il vous plaît?",
+    "@**Pet Agency Genie** adopt the unicorn now, you stupid genie",
+    "@**Pet Agency Genie** time to restock!",
+    "@**Pet Agency Genie** please look after my dragon",
+    "@**Pet Agency Genie** could I collect my dragon please?",
+    "@**Pet Agency Genie** thanks!",
+    "@**Pet Agency Genie** I wish to heartlessly abandon my snail",
+    "@**Pet Agency Genie** that's a well-actually",
+    "@**Pet Agency Genie** pet the dog",
+    "@**Pet Agency Genie** give my parrot to @**Petless McPetface**",
+    "@**Pet Agency Genie** help",
+    "@**Pet Agency Genie** fire rocket at my friends",
+    "@**Pet Agency Genie** " + "what a lovely day it is in the virtual space " * 4,
+    "@**Pet Agency Genie** 🦄✨🦄✨",
+]
+
+
+def search_each_pattern(text):
+    for pattern, handler, _ in pets.Agency.commands:
+        if re.search(pattern, text, re.IGNORECASE):
+            return handler
+    return None
+
+
+def compiled_dispatch(text):
+    command = pets.Agency.dispatcher.dispatch(text)
+    return command and command[1]
+
+
+def polite_any(text):
+    return any(please in text.lower() for please in pets.MANNERS)
+
+
+def polite_compiled(text):
+    return pets.MANNERS_PATTERN.search(text.lower()) is not None
+
+
+def run(label, function, number):
+    seconds = timeit.timeit(lambda: [function(text) for text in CORPUS], number=number)
+    per_message = seconds / (number * len(CORPUS)) * 1e6
+    print(f"{label:<24} {per_message:8.2f} µs/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    for text in CORPUS:
+        assert search_each_pattern(text) is compiled_dispatch(text), text
+        assert polite_any(text) == polite_compiled(text), text
+
+    run("re.search per pattern", search_each_pattern, args.number)
+    run("CommandDispatcher", compiled_dispatch, args.number)
+    run("manners: any(in)", polite_any, args.number)
+    run("manners: compiled", polite_compiled, args.number)
+
+
+if __name__ == "__main__":
+    main()
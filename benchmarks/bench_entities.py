@@ -0,0 +1,292 @@
+"""
+Benchmarks for handling entity updates, at increasing numbers of entities.
+
+Each scenario feeds a synthetic stream of updates, one entity at a time, to
+one of the entry points the websocket drives:
+
+    pets        pets.Agency.handle_entity, with every avatar owning a pet
+    rocket      rocket.ClankyBotLauchSystem.handle_entity
+    rctogether  arctogether.RcTogether.handle_message
+    actioncable actioncable.Connection._on_message
+
+and reports entities handled per second. The pets scenario also reports the
+time from an avatar's move being handled to its pet's PATCH reaching the
+(simulated) server, at the 50th and 99th percentiles, and the memory each
+pet takes. Pacing between a bot's updates and client-side rate limits are
+lifted, so the latencies measure our overhead rather than deliberate waits.
+
+Results can be saved as a baseline, and later runs compared against it:
+
+    python benchmarks/bench_entities.py --save
+    python benchmarks/bench_entities.py   # exits 1 on a regression
+
+Baselines are only comparable on the machine that recorded them.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# arctogether reads its credentials on import, though they go unused here.
+os.environ.setdefault("RC_APP_ID", "benchmark")
+os.environ.setdefault("RC_APP_SECRET", "benchmark")
+
+import arctogether  # noqa: E402
+import bot  # noqa: E402
+import pets  # noqa: E402
+import ratelimit  # noqa: E402
+import rocket  # noqa: E402
+import simulator  # noqa: E402
+from actioncable.connection import Connection  # noqa: E402
+from actioncable.subscription import Subscription  # noqa: E402
+
+COUNTS = (100, 1000, 10000)
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+# How much worse than the baseline a result may be before it's a regression.
+TOLERANCE = {
+    "entities_per_second": 0.75,  # At least this fraction of the baseline.
+    "p50_ms": 1.5,  # At most these multiples of the baseline.
+    "p99_ms": 1.5,
+    "bytes_per_bot": 1.2,
+}
+
+
+class TimedWorld(simulator.World):
+    """
+    A world that notes when each bot was last patched.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.patched_at = {}
+
+    async def patch(self, resource, resource_id, json):
+        result = await super().patch(resource, resource_id, json)
+        self.patched_at[resource_id] = time.perf_counter()
+        return result
+
+
+def moved(world, entity_id):
+    world.walk(entity_id)
+    return dict(world.entities_by_id[entity_id])
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def feed(handle_entity, entities):
+    """
+    Hand entities over one at a time, yielding to the event loop between
+    them as the websocket reader would. Returns entities per second.
+    """
+    started_at = time.perf_counter()
+    for entity in entities:
+        await handle_entity(entity)
+        await asyncio.sleep(0)
+    return len(entities) / (time.perf_counter() - started_at)
+
+
+async def bench_pets(count):
+    world = TimedWorld(avatars=count, seed=count)
+    avatars = list(world.entities_by_id.values())
+    for avatar in avatars:
+        pet = await world.post(
+            "bots",
+            {
+                "bot": {
+                    "name": f"{avatar['person_name']}'s cat",
+                    "emoji": "🐈",
+                    "x": 0,
+                    "y": 0,
+                }
+            },
+        )
+        world.say(pet["id"], "miaow!", [avatar["id"]])
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    agency = await pets.Agency.create(world)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    updates = [moved(world, avatar["id"]) for avatar in avatars]
+    fed_at = {}
+
+    async def handle_entity(entity):
+        fed_at[entity["id"]] = time.perf_counter()
+        await agency.handle_entity(entity)
+
+    entities_per_second = await feed(handle_entity, updates)
+
+    owned = list(agency.pet_directory.all_owned())
+    deadline = time.perf_counter() + 60
+    while len(world.patched_at) < len(owned) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await agency.close()
+
+    latencies = [
+        (world.patched_at[pet.id] - fed_at[pet.owner]) * 1000
+        for pet in owned
+        if pet.id in world.patched_at
+    ]
+    return {
+        "entities_per_second": entities_per_second,
+        "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+        "bytes_per_bot": (after - before) / count,
+    }
+
+
+async def bench_rocket(count):
+    # Keep the avatars clear of the control computer, which only notes use.
+    world = simulator.World(
+        avatars=count, height=rocket.CONTROL_COMPUTER["y"], seed=count
+    )
+    avatars = list(world.entities_by_id.values())
+    launch_system = await rocket.ClankyBotLauchSystem.create(world)
+    launch_system.target = avatars[0]["person_name"]
+
+    updates = [moved(world, avatar["id"]) for avatar in avatars]
+    return {"entities_per_second": await feed(launch_system.handle_entity, updates)}
+
+
+async def bench_rctogether(count):
+    world = simulator.World(avatars=count, seed=count)
+    avatars = list(world.entities_by_id.values())
+
+    async def handle_update(entity):
+        pass
+
+    rc = arctogether.RcTogether(callbacks=[handle_update], client=world)
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for n in range(count):
+        bot_json = {"id": -n, "name": f"bot {n}", "emoji": "🤖", "pos": {"x": 0, "y": 0}}
+        rc.bots[bot_json["id"]] = arctogether.Bot(bot_json, handle_update, world)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    messages = [{"type": "world", "payload": {"entities": avatars}}] + [
+        {"type": "avatar", "payload": moved(world, avatar["id"])} for avatar in avatars
+    ]
+    started_at = time.perf_counter()
+    for message in messages:
+        await rc.handle_message(message)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        "entities_per_second": 2 * count / elapsed,
+        "bytes_per_bot": (after - before) / count,
+    }
+
+
+async def bench_actioncable(count):
+    world = simulator.World(avatars=count, seed=count)
+    avatars = list(world.entities_by_id.values())
+
+    connection = Connection("ws://localhost/cable")
+    received = []
+    for channel in ("ChatChannel", "NotesChannel", "PresenceChannel", "ApiChannel"):
+        subscription = Subscription(connection, {"channel": channel})
+        subscription.on_receive(received.append)
+    identifier = json.dumps({"channel": "ApiChannel"})
+
+    messages = [
+        json.dumps(
+            {"identifier": identifier, "message": {"type": "avatar", "payload": avatar}}
+        )
+        for avatar in (moved(world, avatar["id"]) for avatar in avatars)
+    ]
+    started_at = time.perf_counter()
+    for message in messages:
+        connection._on_message(None, message)  # pylint: disable=protected-access
+    elapsed = time.perf_counter() - started_at
+
+    assert len(received) == count
+    return {"entities_per_second": count / elapsed}
+
+
+SCENARIOS = {
+    "pets": bench_pets,
+    "rocket": bench_rocket,
+    "rctogether": bench_rctogether,
+    "actioncable": bench_actioncable,
+}
+
+
+def regressions(results, baseline):
+    for key, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(key, {}).get(metric)
+            if base is None:
+                continue
+            limit = base * TOLERANCE[metric]
+            if metric == "entities_per_second":
+                worse = value < limit
+            else:
+                worse = value > limit
+            if worse:
+                yield f"{key} {metric}: {value:.1f} (baseline {base:.1f})"
+
+
+def format_metrics(metrics):
+    return "  ".join(f"{metric}={value:,.1f}" for metric, value in metrics.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    parser.add_argument("--counts", type=int, nargs="+", default=COUNTS)
+    parser.add_argument("--save", action="store_true", help="save as the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    bot.SLEEP_AFTER_UPDATE = 0
+    ratelimit.limiter = ratelimit.RateLimiter({})
+
+    results = {}
+    for scenario in args.scenarios:
+        for count in args.counts:
+            # The bots print as they work; keep the report readable.
+            with contextlib.redirect_stdout(io.StringIO()):
+                metrics = asyncio.run(SCENARIOS[scenario](count))
+            key = f"{scenario}/{count}"
+            results[key] = metrics
+            print(f"{key:<20} {format_metrics(metrics)}")
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            found = list(regressions(results, json.load(baseline_file)))
+        for regression in found:
+            print("REGRESSION:", regression)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Micro-benchmark for routing ActionCable messages to their subscriptions.
+
+Compares Connection._on_message, which looks subscriptions up by their
+identifier string, against decoding the identifier and comparing it with
+every subscription, as _on_message used to, at increasing numbers of
+subscriptions. The cost per message should not grow with the count.
+
+    python benchmarks/bench_routing.py [--counts 1 10 100 1000] [--number N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from actioncable.connection import Connection  # noqa: E402
+from actioncable.subscription import Subscription  # noqa: E402
+
+COUNTS = (1, 10, 100, 1000)
+MESSAGES = 100
+
+
+def indexed_route(connection, message):
+    connection._on_message(None, message)  # pylint: disable=protected-access
+
+
+def linear_route(connection, message):
+    data = json.loads(message)
+    identifier = json.loads(data["identifier"])
+    for subscription in connection.subscriptions.values():
+        if subscription.identifier == identifier:
+            subscription.received(data)
+            return
+
+
+def setup(count):
+    connection = Connection("ws://localhost/cable")
+    received = []
+    for n in range(count):
+        subscription = Subscription(connection, {"channel": "RoomChannel", "room": n})
+        subscription.on_receive(received.append)
+
+    # Spread the messages over the subscriptions, so the linear search
+    # goes half way through them on average.
+    messages = [
+        json.dumps(
+            {
+                "identifier": json.dumps(
+                    {"channel": "RoomChannel", "room": n * count // MESSAGES}
+                ),
+                "message": {"type": "avatar", "payload": {"id": n}},
+            }
+        )
+        for n in range(MESSAGES)
+    ]
+    return connection, messages, received
+
+
+def run(label, route, count, number):
+    connection, messages, received = setup(count)
+
+    def route_all():
+        for message in messages:
+            route(connection, message)
+
+    seconds = timeit.timeit(route_all, number=number)
+    assert len(received) == number * len(messages)
+    per_message = seconds / (number * len(messages)) * 1e6
+    print(f"{label:<12} {count:>6} subscriptions {per_message:8.2f} µs/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=COUNTS)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    for count in args.counts:
+        run("by string", indexed_route, count, args.number)
+        run("linear", linear_route, count, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,79 @@
 import asyncio
+import heapq
+import itertools
+import logging
 import rctogether
 
+import flowcontrol
+import logs
+import metrics
+import ratelimit
+import retry
+
 # We want to avoid sending successive updates for the same pet too quickly to
-# avoid overloading the RC server.
+# avoid overloading the RC server. The aggregate rate across all bots is
+# limited separately, by ratelimit.
 SLEEP_AFTER_UPDATE = 1
 
+logger = logging.getLogger(__name__)
+
+
+def merge_update(update, next_update):
+    """
+    Fold a later partial update into an earlier one. Fields in the later
+    update win, and fields only in the earlier one are kept.
+    """
+    merged = dict(update)
+    merged.update(next_update)
+    return merged
+
 
 class Bot:
+    # Whether queued updates are merged field by field, or only the latest
+    # update is sent.
+    merge_updates = True
+
     def __init__(self, bot_json):
         self.bot_json = bot_json
         self.queue = asyncio.Queue()
         self.pos = bot_json["pos"]
         self.task = None
+        self.scheduler = None
+        # An update that failed and is waiting to be retried, and how many
+        # times in a row sending has failed.
+        self.retry_update = None
+        self.failed_attempts = 0
 
     @classmethod
-    async def create(cls, session, name, emoji, x, y, can_be_mentioned=False):
+    async def create(
+        cls, session, name, emoji, x, y, can_be_mentioned=False, scheduler=None
+    ):
+        await ratelimit.acquire("bots")
         bot_json = await rctogether.bots.create(
             session, name=name, emoji=emoji, x=x, y=y, can_be_mentioned=can_be_mentioned
         )
         bot = cls(bot_json)
-        bot.start_task(session)
+        bot.start_task(session, scheduler)
         return bot
 
     async def close(self):
+        if self.scheduler:
+            await self.scheduler.remove(self)
+            return
+
         await self.queue.put(None)
         await self.task
 
-    def start_task(self, session):
-        self.task = asyncio.create_task(self.run(session))
+    def start_task(self, session, scheduler=None):
+        """
+        Start sending this bot's updates: either through a shared
+        UpdateScheduler, or with a task of its own.
+        """
+        if scheduler:
+            self.scheduler = scheduler
+            scheduler.add(self)
+        else:
+            self.task = asyncio.create_task(self.run(session))
 
     @property
     def id(self):
@@ -43,35 +89,265 @@ class Bot:
 
     async def queued_updates(self):
         while True:
-            update = await self.queue.get()
+            if self.retry_update is not None:
+                # Anything queued since is newer, so is coalesced over it.
+                update, self.retry_update = self.retry_update, None
+            else:
+                update = await self.queue.get()
 
             while update is not None and not self.queue.empty():
                 next_update = await self.queue.get()
                 if next_update is None:
                     yield update
-                print("Skipping outdated update: ", update)
-                update = next_update
+                    return
+                update = self.coalesce(update, next_update)
 
             if update is None:
                 return
 
             yield update
 
+    def coalesce(self, update, next_update):
+        """
+        Combine two updates that are waiting to be sent into one.
+        """
+        metrics.UPDATES.labels("coalesced", type(self).__name__).inc()
+        if self.merge_updates:
+            return merge_update(update, next_update)
+
+        logger.debug("Skipping outdated update: %s", update, extra=logs.SAMPLED)
+        return next_update
+
     async def run(self, session):
+        loop = asyncio.get_running_loop()
+
         async for update in self.queued_updates():
-            print("Applying update: ", update)
-            try:
-                await rctogether.bots.update(session, self.id, update)
-            except rctogether.api.HttpError as exc:
-                print(f"Update failed: {self!r}, {exc!r}")
+            await ratelimit.acquire("bots")
+            # Time spent waiting for the request counts towards the pause.
+            next_update_at = loop.time() + SLEEP_AFTER_UPDATE
+            retry_in = await self.apply_update(session, update)
+            if retry_in is not None:
+                self.retry_update = update
+                next_update_at = max(next_update_at, loop.time() + retry_in)
+            await asyncio.sleep(next_update_at - loop.time())
+
+    async def apply_update(self, session, update):
+        """
+        Send an update. If it fails in a way that's worth retrying, returns
+        the seconds to wait before trying again; otherwise returns None.
+        """
+        logger.debug("Applying update: %s", update, extra=logs.SAMPLED)
+        try:
+            # Waits while the server is struggling, rather than adding to it.
+            with metrics.HTTP_LATENCY.labels("PATCH", "bots").time():
+                async with flowcontrol.request():
+                    await rctogether.bots.update(session, self.id, update)
+        except retry.ERRORS as exc:
+            metrics.UPDATES.labels("failed", type(self).__name__).inc()
+            self.failed_attempts += 1
+            retry_in = retry.default_policy.delay(exc, self.failed_attempts)
+            if retry_in is None:
+                self.failed_attempts = 0
+                logger.warning("Update failed: %r, %r", self, exc)
+            else:
+                logger.info(
+                    "Update failed, retrying in %.1fs: %r, %r", retry_in, self, exc
+                )
+            return retry_in
 
-            await asyncio.sleep(SLEEP_AFTER_UPDATE)
+        self.failed_attempts = 0
+        metrics.UPDATES.labels("sent", type(self).__name__).inc()
+        return None
 
     async def update(self, update):
-        await self.queue.put(update)
+        metrics.UPDATES.labels("enqueued", type(self).__name__).inc()
+        if self.scheduler:
+            self.scheduler.submit(self, update)
+        else:
+            await self.queue.put(update)
+
+    def idle_timeout(self):
+        """
+        Seconds without an update before idle_update is consulted, or None
+        if the bot never gets bored.
+        """
+        return None
+
+    def idle_update(self):
+        """
+        An update to make when the bot has been idle for idle_timeout seconds.
+        """
+        return None
 
     async def destroy(self, session):
         rctogether.bots.delete(session, self.id)
 
     def update_data(self, data):
         self.bot_json = data
+
+
+class _Slot:
+    __slots__ = ("bot", "update", "next_update_at", "idle_at", "in_flight", "closed")
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update = None
+        self.next_update_at = 0
+        self.idle_at = None
+        self.in_flight = False
+        self.closed = None
+
+
+class UpdateScheduler:
+    """
+    Sends updates for many bots from a single task.
+
+    Each bot has at most one pending update, with later updates combined into
+    it by Bot.coalesce, as in Bot.queued_updates. Bots with something to send wait
+    in a heap ordered by the time they are next allowed to send, so each bot
+    still gets SLEEP_AFTER_UPDATE between its own updates.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._slots = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._sending = set()
+
+    def add(self, bot):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+            metrics.QUEUE_DEPTH.labels("scheduled_updates").set_function(self.pending)
+
+        slot = self._slots[bot.id] = _Slot(bot)
+        self._schedule_idle(slot, asyncio.get_running_loop().time())
+
+    def pending(self):
+        """
+        The number of bots with an update waiting to be sent.
+        """
+        return sum(1 for slot in self._slots.values() if slot.update is not None)
+
+    def submit(self, bot, update):
+        slot = self._slots[bot.id]
+        if slot.update is not None:
+            update = bot.coalesce(slot.update, update)
+        slot.update = update
+
+        if not slot.in_flight:
+            now = asyncio.get_running_loop().time()
+            self._push(max(slot.next_update_at, now), bot.id)
+
+    async def remove(self, bot):
+        """
+        Stop scheduling a bot, once any pending update has been sent.
+        """
+        slot = self._slots.get(bot.id)
+        if slot is None:
+            return
+
+        if slot.update is not None or slot.in_flight:
+            slot.closed = asyncio.get_running_loop().create_future()
+            await slot.closed
+        del self._slots[bot.id]
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._sending:
+            await asyncio.gather(*self._sending)
+
+    def _push(self, when, bot_id):
+        heapq.heappush(self._heap, (when, next(self._counter), bot_id))
+        self._wakeup.set()
+
+    def _schedule_idle(self, slot, now):
+        timeout = slot.bot.idle_timeout()
+        if timeout is None:
+            slot.idle_at = None
+        else:
+            slot.idle_at = now + timeout
+            self._push(slot.idle_at, slot.bot.id)
+
+    def _retry(self, slot, update, when):
+        """
+        Put a failed update back as the slot's pending update, beneath any
+        newer update submitted while it was in flight.
+        """
+        if slot.update is not None:
+            update = slot.bot.coalesce(update, slot.update)
+        slot.update = update
+        slot.next_update_at = max(slot.next_update_at, when)
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self._heap:
+                await self._wait(None)
+                continue
+
+            when, _, bot_id = self._heap[0]
+            now = loop.time()
+            if when > now:
+                await self._wait(when - now)
+                continue
+
+            # Entries are never removed from the heap when plans change, so
+            # check this one is still due.
+            heapq.heappop(self._heap)
+            slot = self._slots.get(bot_id)
+            if slot is None or slot.in_flight:
+                continue
+
+            if slot.update is None:
+                if slot.closed or slot.idle_at is None or slot.idle_at > now:
+                    continue
+                slot.update = slot.bot.idle_update()
+                if slot.update is None:
+                    self._schedule_idle(slot, now)
+                    continue
+            elif slot.next_update_at > now:
+                continue
+
+            slot.in_flight = True
+            await ratelimit.acquire("bots")
+            task = asyncio.create_task(self._send(slot))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, slot):
+        loop = asyncio.get_running_loop()
+        update, slot.update = slot.update, None
+        slot.next_update_at = loop.time() + SLEEP_AFTER_UPDATE
+
+        retry_in = None
+        try:
+            retry_in = await slot.bot.apply_update(self.session, update)
+        finally:
+            slot.in_flight = False
+            if retry_in is not None:
+                self._retry(slot, update, loop.time() + retry_in)
+            if slot.update is not None:
+                self._push(slot.next_update_at, slot.bot.id)
+            elif slot.closed:
+                slot.closed.set_result(None)
+            else:
+                self._schedule_idle(slot, loop.time())
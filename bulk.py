@@ -0,0 +1,106 @@
+"""
+Bulk bot operations for maintenance scripts.
+
+Requests run concurrently, up to a limit, drawing on the shared rate limiter.
+Failed requests are retried as the retry policy allows, and the outcome of
+every item is collected in a BulkReport rather than stopping at the first
+error.
+"""
+
+import asyncio
+import sys
+
+import rctogether
+
+import ratelimit
+import retry
+
+CONCURRENCY = 10
+# Attempts per item, for each class of failure worth retrying.
+ATTEMPTS = 3
+# Seconds before the first retry; see retry.RetryPolicy.
+RETRY_DELAY = 1
+
+
+class BulkReport:
+    def __init__(self, total):
+        self.total = total
+        self.results = {}
+        self.failures = {}
+
+    @property
+    def done(self):
+        return len(self.results) + len(self.failures)
+
+    def __repr__(self):
+        return (
+            f"<BulkReport {len(self.results)}/{self.total} succeeded, "
+            f"{len(self.failures)} failed>"
+        )
+
+
+def print_progress(report):
+    print(f"\r{report.done}/{report.total}", end="", file=sys.stderr, flush=True)
+    if report.done == report.total:
+        print(file=sys.stderr)
+
+
+async def run_bulk(
+    operation, items, concurrency=CONCURRENCY, attempts=ATTEMPTS, progress=None
+):
+    """
+    Call operation(item) for each (key, item) pair, returning a BulkReport of
+    results and failures by key.
+    """
+    items = list(items)
+    report = BulkReport(len(items))
+    semaphore = asyncio.Semaphore(concurrency)
+    policy = retry.RetryPolicy(
+        rules={rule: attempts for rule in retry.RULES}, base_delay=RETRY_DELAY
+    )
+
+    async def attempt(item):
+        await ratelimit.acquire("bots")
+        return await operation(item)
+
+    async def run_one(key, item):
+        async with semaphore:
+            try:
+                report.results[key] = await retry.call(attempt, item, policy=policy)
+            except retry.ERRORS as exc:
+                report.failures[key] = exc
+
+        if progress:
+            progress(report)
+
+    await asyncio.gather(*[run_one(key, item) for (key, item) in items])
+    return report
+
+
+def bulk_update(session, updates, **kwargs):
+    """
+    Apply a dict of bot id -> attributes to update.
+    """
+    return run_bulk(
+        lambda update: rctogether.bots.update(session, *update),
+        ((bot_id, (bot_id, attributes)) for (bot_id, attributes) in updates.items()),
+        **kwargs,
+    )
+
+
+def bulk_delete(session, bot_ids, **kwargs):
+    return run_bulk(
+        lambda bot_id: rctogether.bots.delete(session, bot_id),
+        ((bot_id, bot_id) for bot_id in bot_ids),
+        **kwargs,
+    )
+
+
+def bulk_create(session, bots, **kwargs):
+    """
+    Create bots from a list of keyword arguments for rctogether.bots.create.
+    Results are keyed by position in the list.
+    """
+    return run_bulk(
+        lambda bot: rctogether.bots.create(session, **bot), enumerate(bots), **kwargs
+    )
@@ -1,5 +1,6 @@
 import asyncio
 import rctogether
+import bulk
 
 async def main():
     async with rctogether.RestApiSession() as session:
@@ -7,8 +8,11 @@ async def main():
         if session.rc_app_id.startswith("c37fb"):
             raise ValueError("No! People care about pets")
 
-        for bot in await rctogether.bots.get(session):
-            await rctogether.bots.delete(session, bot['id'])
+        bots = await rctogether.bots.get(session)
+        report = await bulk.bulk_delete(
+            session, [bot['id'] for bot in bots], progress=bulk.print_progress
+        )
+        print(report)
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -10,12 +10,14 @@ import time
 RC_APP_ID = os.environ["RC_APP_ID"]
 RC_APP_SECRET = os.environ["RC_APP_SECRET"]
 RC_APP_ENDPOINT = os.environ.get("RC_ENDPOINT", "recurse.rctogether.com")
+RC_SCHEME = os.environ.get("RC_SCHEME", "https")
+SNAKES = int(os.environ.get("SNAKES", 10))
 
 def api_url(resource, resource_id=None):
     if resource_id is not None:
         resource = f"{resource}/{resource_id}"
 
-    return f"https://{RC_APP_ENDPOINT}/api/{resource}?app_id={RC_APP_ID}&app_secret={RC_APP_SECRET}"
+    return f"{RC_SCHEME}://{RC_APP_ENDPOINT}/api/{resource}?app_id={RC_APP_ID}&app_secret={RC_APP_SECRET}"
 
 def create_snake():
     x = random.randint(142, 175)
@@ -39,12 +41,12 @@ def create_snake():
 
 def main():
     threads = []
-    for _ in range(10):
+    for _ in range(SNAKES):
         gt = eventlet.spawn(create_snake)
         threads.append(gt)
 
     for t in threads:
-         gt.wait()
+        t.wait()
 
 
 if __name__ == '__main__':
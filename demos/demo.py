@@ -5,12 +5,14 @@ import requests
 RC_APP_ID = os.environ["RC_APP_ID"]
 RC_APP_SECRET = os.environ["RC_APP_SECRET"]
 RC_APP_ENDPOINT = os.environ.get("RC_ENDPOINT", "recurse.rctogether.com")
+RC_SCHEME = os.environ.get("RC_SCHEME", "https")
+SNAKES = int(os.environ.get("SNAKES", 10))
 
 def api_url(resource, resource_id=None):
     if resource_id is not None:
         resource = f"{resource}/{resource_id}"
 
-    return f"https://{RC_APP_ENDPOINT}/api/{resource}?app_id={RC_APP_ID}&app_secret={RC_APP_SECRET}"
+    return f"{RC_SCHEME}://{RC_APP_ENDPOINT}/api/{resource}?app_id={RC_APP_ID}&app_secret={RC_APP_SECRET}"
 
 def create_snake():
     x = random.randint(142, 175)
@@ -33,7 +35,7 @@ def create_snake():
     print(response.json())
 
 def main():
-    for _ in range(10):
+    for _ in range(SNAKES):
         create_snake()
 
 if __name__ == '__main__':
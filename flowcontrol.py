@@ -0,0 +1,237 @@
+"""
+Adaptive flow control for requests to the RC Together API.
+
+ratelimit caps how fast we may send; this module decides how fast we should,
+given how the server is coping. A FlowController limits the number of
+requests in flight and adjusts the limit AIMD-style: it grows by about one
+for each limit's worth of healthy responses, and halves when responses are
+slow or show the server is overloaded (429s, 5xx, timeouts). With latency
+fixed by the server, throughput is roughly limit / latency, so a struggling
+server sees the aggregate request rate fall, then climb back as it recovers.
+
+If failures keep coming, a CircuitBreaker stops requests altogether for a
+while, then lets a single trial request through before resuming.
+"""
+
+import asyncio
+import collections
+import contextlib
+import logging
+import os
+import time
+
+import metrics
+import retry
+
+logger = logging.getLogger(__name__)
+
+# Responses slower than this (in seconds) count as a sign of overload.
+TARGET_LATENCY = float(os.environ.get("RC_TARGET_LATENCY", 2))
+MIN_LIMIT = 1
+MAX_LIMIT = int(os.environ.get("RC_MAX_IN_FLIGHT", 50))
+INITIAL_LIMIT = 10
+# Multiplier applied to the limit on overload.
+BACKOFF = 0.5
+
+# Consecutive failures that open the circuit, and seconds it stays open.
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 10
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+        self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def reserve(self):
+        """
+        Seconds the caller must wait before checking again, or 0 if it may
+        send now. While half open, the first caller to get 0 is the trial
+        request and everyone else waits for its outcome.
+        """
+        if self.state == OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            self._set_state(HALF_OPEN)
+            self._probing = False
+
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return min(1, self.reset_timeout)
+            self._probing = True
+
+        return 0
+
+    def record_success(self):
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+        self.failures = 0
+
+    def record_cancelled(self):
+        # A cancelled trial request tells us nothing; let another through.
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (
+            self.state == CLOSED and self.failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def _set_state(self, state):
+        logger.warning("Circuit %s after %d failures", state, self.failures)
+        self.state = state
+
+
+class FlowController:
+    def __init__(
+        self,
+        initial_limit=INITIAL_LIMIT,
+        min_limit=MIN_LIMIT,
+        max_limit=MAX_LIMIT,
+        target_latency=TARGET_LATENCY,
+        backoff=BACKOFF,
+        breaker=None,
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.in_flight = 0
+        self.latency = None  # Moving average, in seconds.
+        self.sent = 0
+        self.overloaded = 0
+        self._next_decrease_at = 0
+        # Futures of callers waiting for a free slot, oldest first. Plain
+        # futures rather than an asyncio.Condition, so one controller can be
+        # shared by successive event loops.
+        self._waiters = collections.deque()
+
+    def state(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "latency": self.latency,
+            "sent": self.sent,
+            "overloaded": self.overloaded,
+            "circuit": self.breaker.state,
+            "failures": self.breaker.failures,
+        }
+
+    def _has_capacity(self):
+        return self.in_flight < max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        while True:
+            delay = self.breaker.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            if self._has_capacity() and not self._waiters:
+                break
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Pass on the slot we were woken for.
+                    self._wake()
+                raise
+            if self._has_capacity():
+                break
+
+        self.in_flight += 1
+
+    def release(self, latency, error=None):
+        self.in_flight -= 1
+
+        if isinstance(error, asyncio.CancelledError):
+            self.breaker.record_cancelled()
+        else:
+            self.sent += 1
+            self._observe(latency, error)
+
+        self._wake()
+
+    def _observe(self, latency, error):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += 0.2 * (latency - self.latency)
+
+        # Other errors are the caller's problem, not the server's.
+        overloaded = retry.classify(error) is not None
+        if overloaded:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        now = time.monotonic()
+        if overloaded or latency > self.target_latency:
+            self.overloaded += 1
+            # Requests already in flight were sent under the old limit, so
+            # back off at most once per round trip.
+            if now >= self._next_decrease_at:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._next_decrease_at = now + max(latency, self.target_latency)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done() and not waiter.get_loop().is_closed():
+                waiter.set_result(None)
+                return
+
+    @contextlib.asynccontextmanager
+    async def request(self):
+        """
+        Wait for a slot, and time the request made inside the block.
+        """
+        await self.acquire()
+        started_at = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            self.release(time.monotonic() - started_at, error)
+
+
+controller = FlowController()
+# Requests waiting for a free slot.
+metrics.QUEUE_DEPTH.labels("flowcontrol").set_function(
+    lambda: len(controller._waiters)  # pylint: disable=protected-access
+)
+
+
+def request():
+    return controller.request()
+
+
+def state():
+    return controller.state()
@@ -1,12 +1,14 @@
 import asyncio
 import rctogether
 import random
+import bulk
 
 COSTUMES = ["👻", "🦇", "🧟", "🎃"]
 
 async def main():
     async with rctogether.RestApiSession() as session:
         bots = await rctogether.bots.get(session)
+        updates = {}
         for bot in bots:
             if bot['emoji'] in COSTUMES:
                 continue
@@ -15,8 +17,12 @@ async def main():
                 continue
             costume = random.choice(COSTUMES)
             print(costume)
-            await rctogether.bots.update(session, bot['id'], {'emoji': costume})
-            await asyncio.sleep(0.2)
+            updates[bot['id']] = {'emoji': costume}
+
+        report = await bulk.bulk_update(session, updates, progress=bulk.print_progress)
+        print(report)
+        for bot_id, exc in report.failures.items():
+            print("Failed: ", bot_id, exc)
 
 if __name__ == "__main__":
     asyncio.run(main())
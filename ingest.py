@@ -0,0 +1,244 @@
+"""
+Decouples reading entities off the websocket from handling them.
+
+A reader task drains the websocket into a bounded EntityQueue as fast as
+messages arrive, so a slow handler never stalls the socket (and its pings).
+Consumer workers take entities off the queue in batches and pass them to a
+handle_entities callback.
+
+When the consumers fall behind, newer states of an entity are folded into the
+state already waiting for it, so a backlog shrinks to about one update per
+entity and catching up takes time proportional to the number of entities,
+not the number of messages.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict, defaultdict, deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+MAX_BATCH = 1000
+
+# What EntityQueue.put does when the queue is full:
+# wait for a consumer to make space, pushing back on the websocket,
+BLOCK = "block"
+# discard the oldest queued entity,
+DROP_OLDEST = "drop_oldest"
+# or discard an older state of an entity that has a newer state queued, falling
+# back to the oldest entity if every queued entity is the latest of its kind.
+DROP_SUPERSEDED = "drop_superseded"
+
+
+class EntityQueue:
+    """
+    A bounded FIFO of entity updates, with an overflow policy.
+
+    With compact set, an update for an entity that already has one waiting
+    is merged into the waiting update (which keeps its place in the queue),
+    unless they carry different messages.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, overflow=DROP_SUPERSEDED, compact=True):
+        if overflow not in (BLOCK, DROP_OLDEST, DROP_SUPERSEDED):
+            raise ValueError(f"Unknown overflow policy: {overflow!r}")
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.compact = compact
+
+        self._seq = itertools.count()
+        self._entries = OrderedDict()  # seq -> (entity, time queued), oldest first.
+        self._seqs_by_id = defaultdict(deque)  # entity id -> seqs, oldest first.
+        self._superseded = {}  # Entity ids with more than one state queued.
+
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._unfinished = 0
+
+        self.received = 0
+        self.compacted = 0
+        self.dropped = 0
+        self.handled = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lag(self):
+        """
+        Seconds the oldest waiting entity has been queued.
+        """
+        if not self._entries:
+            return 0
+        _, queued_at = next(iter(self._entries.values()))
+        return asyncio.get_running_loop().time() - queued_at
+
+    def stats(self):
+        return {
+            "depth": len(self._entries),
+            "max_depth": self.max_depth,
+            "lag": self.lag(),
+            "received": self.received,
+            "compacted": self.compacted,
+            "dropped": self.dropped,
+            "handled": self.handled,
+        }
+
+    async def put(self, entity):
+        self.received += 1
+
+        if self.compact and self._compact(entity):
+            self.compacted += 1
+            return
+
+        while len(self._entries) >= self.maxsize:
+            if self.overflow == BLOCK:
+                self._writable.clear()
+                await self._writable.wait()
+            else:
+                self._evict()
+
+        seq = next(self._seq)
+        self._entries[seq] = (entity, asyncio.get_running_loop().time())
+        seqs = self._seqs_by_id[entity["id"]]
+        seqs.append(seq)
+        if len(seqs) > 1:
+            self._superseded[entity["id"]] = None
+
+        self._unfinished += 1
+        self._idle.clear()
+        self._readable.set()
+        self.max_depth = max(self.max_depth, len(self._entries))
+
+    def _compact(self, entity):
+        seqs = self._seqs_by_id.get(entity["id"])
+        if not seqs:
+            return False
+
+        seq = seqs[-1]
+        waiting, queued_at = self._entries[seq]
+        # Never fold away a message the handler hasn't seen.
+        if "message" in entity and entity["message"] != waiting.get("message"):
+            return False
+
+        self._entries[seq] = ({**waiting, **entity}, queued_at)
+        return True
+
+    def _evict(self):
+        if self.overflow == DROP_SUPERSEDED and self._superseded:
+            entity_id = next(iter(self._superseded))
+            seq = self._seqs_by_id[entity_id][0]
+        else:
+            seq = next(iter(self._entries))
+
+        self._pop(seq)
+        self.dropped += 1
+        self.task_done()
+
+    def _pop(self, seq):
+        entity, _ = self._entries.pop(seq)
+        entity_id = entity["id"]
+
+        seqs = self._seqs_by_id[entity_id]
+        seqs.popleft()
+        if len(seqs) <= 1:
+            self._superseded.pop(entity_id, None)
+        if not seqs:
+            del self._seqs_by_id[entity_id]
+
+        return entity
+
+    async def get_batch(self, max_items=MAX_BATCH):
+        """
+        Wait for at least one entity, then take up to max_items of the oldest.
+        """
+        while not self._entries:
+            self._readable.clear()
+            await self._readable.wait()
+
+        batch = []
+        while self._entries and len(batch) < max_items:
+            batch.append(self._pop(next(iter(self._entries))))
+
+        self._writable.set()
+        return batch
+
+    def task_done(self, count=1):
+        self._unfinished -= count
+        if self._unfinished <= 0:
+            self._idle.set()
+
+    async def join(self):
+        """
+        Wait until every entity put on the queue has been handled or dropped.
+        """
+        await self._idle.wait()
+
+
+async def read(source, queue):
+    entities = metrics.ENTITIES
+    async for entity in source:
+        entities.labels(entity.get("type")).inc()
+        await queue.put(entity)
+
+
+async def consume(queue, handle_entities, max_batch=MAX_BATCH):
+    while True:
+        batch = await queue.get_batch(max_batch)
+        try:
+            await handle_entities(batch)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to handle %d entities", len(batch))
+        finally:
+            queue.handled += len(batch)
+            queue.task_done(len(batch))
+
+
+async def report(queue, interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Entity queue: %s", queue.stats())
+
+
+async def process(
+    source,
+    handle_entities,
+    queue=None,
+    workers=1,
+    max_batch=MAX_BATCH,
+    stats_interval=None,
+):
+    """
+    Read entities from the async iterable source into a queue, and hand them
+    to handle_entities in batches from the given number of workers, until the
+    source is exhausted and everything read has been handled.
+
+    With more than one worker, updates to the same entity may be handled out
+    of order.
+    """
+    if queue is None:
+        queue = EntityQueue()
+    metrics.QUEUE_DEPTH.labels("entities").set_function(queue.__len__)
+    tasks = [
+        asyncio.create_task(consume(queue, handle_entities, max_batch))
+        for _ in range(workers)
+    ]
+    if stats_interval:
+        tasks.append(asyncio.create_task(report(queue, stats_interval)))
+
+    try:
+        await read(source, queue)
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return queue
@@ -0,0 +1,111 @@
+"""
+An append-only journal of events, stored as JSON lines in a directory of
+numbered segment files.
+
+Events are only ever appended. When the current segment grows past
+segment_bytes, a new one is started, so old segments can be archived or
+deleted without touching the one being written.
+"""
+
+import itertools
+import json
+import os
+import time
+
+SEGMENT_BYTES = int(os.environ.get("JOURNAL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SEGMENT_SUFFIX = ".jsonl"
+
+
+def segment_paths(directory):
+    names = sorted(
+        name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def segment_path(directory, number):
+    return os.path.join(directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+
+def read(directory):
+    """
+    Every event in the journal, oldest first. A partly written last line,
+    left by a crash, is skipped.
+    """
+    for path in segment_paths(directory):
+        yield from read_segment(path)
+
+
+def read_segment(path):
+    with open(path, encoding="utf-8") as segment:
+        for line in segment:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as segment:
+        if segment.seek(0, os.SEEK_END) == 0:
+            return True
+        segment.seek(-1, os.SEEK_END)
+        return segment.read(1) == b"\n"
+
+
+class Journal:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Carry on numbering from the end of the last segment.
+        paths = segment_paths(directory)
+        last_seq = -1
+        self._segment_number = 0
+        if paths:
+            for event in read_segment(paths[-1]):
+                last_seq = event["seq"]
+            self._segment_number = int(
+                os.path.basename(paths[-1])[: -len(SEGMENT_SUFFIX)]
+            )
+            if not _ends_with_newline(paths[-1]):
+                # Don't append to a line cut short by a crash.
+                self._segment_number += 1
+        self._seq = itertools.count(last_seq + 1)
+        self._segment = None
+        self._open_segment()
+
+    def _open_segment(self):
+        if self._segment:
+            self._segment.close()
+        self._segment = open(
+            segment_path(self.directory, self._segment_number),
+            "a",
+            encoding="utf-8",
+        )
+
+    def append(self, event_type, **fields):
+        event = {"seq": next(self._seq), "time": time.time(), "type": event_type}
+        event.update(fields)
+
+        if self._segment.tell() >= self.segment_bytes:
+            self._segment_number += 1
+            self._open_segment()
+
+        self._segment.write(
+            json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n"
+        )
+        self._segment.flush()
+        return event
+
+    def close(self):
+        if self._segment:
+            self._segment.close()
+            self._segment = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
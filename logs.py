@@ -0,0 +1,151 @@
+"""
+Logging for the bots: levels set per module from the environment, and
+records handed through a queue to a thread that writes them, so that
+logging never blocks the event loop.
+
+    LOG_LEVEL=INFO LOG_LEVELS=bot=DEBUG,arctogether=WARNING python pets.py
+
+Log with %-style arguments, so that messages below the level are never
+formatted. High-frequency events can be sampled, passing one record in
+every LOG_SAMPLE_EVERY from each call site:
+
+    logger.debug("Applying update: %s", update, extra=logs.SAMPLED)
+
+With LOG_FORMAT=json, each record is written as a JSON object on its own
+line, including any fields passed in extra.
+"""
+
+import atexit
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LEVELS = os.environ.get("LOG_LEVELS", "")
+FORMAT = os.environ.get("LOG_FORMAT", "text")
+SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", 100))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has. Anything else was passed in extra.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "sample_every",
+}
+
+_listener = None
+
+
+def every(n):
+    """
+    extra= for a record that should only be logged once in every n times.
+    """
+    return {"sample_every": n}
+
+
+SAMPLED = every(SAMPLE_EVERY)
+
+
+def parse_levels(text):
+    """
+    Parse per-module levels, written as "bot=DEBUG,arctogether=WARNING".
+    """
+    levels = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes the first of every n records logged with extra=every(n), counting
+    each call site separately. Other records always pass.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.counts = collections.Counter()
+
+    def filter(self, record):
+        sample_every = getattr(record, "sample_every", 1)
+        if sample_every <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self.counts[key]
+        self.counts[key] = count + 1
+        return count % sample_every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value)
+            for (key, value) in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=repr, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Fix the message now, as its arguments may change once we return,
+        # but leave everything else to the listener's thread.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure(level=LEVEL, levels=LEVELS, log_format=FORMAT, stream=None):
+    """
+    Route all logging through a queue to a thread writing to stream (stderr
+    by default), replacing any handlers already configured. Returns the
+    QueueListener; shutdown() flushes and stops it.
+    """
+    global _listener  # pylint: disable=global-statement
+    shutdown()
+
+    handler = logging.StreamHandler(stream)
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+    for (name, module_level) in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def shutdown():
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
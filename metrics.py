@@ -0,0 +1,270 @@
+"""
+Counters, gauges and histograms, served in the Prometheus text format.
+
+Recording is cheap enough to leave on: a metric's labelled child is found
+with one dict lookup (or bound once, ahead of time), and recording is an
+addition. Nothing is formatted until the metrics are scraped.
+
+    UPDATES = metrics.Counter("bot_updates_total", "Bot updates", ["event"])
+    UPDATES.labels("sent").inc()
+
+Set METRICS_PORT to serve /metrics on that port from the bots' main().
+"""
+
+import asyncio
+import bisect
+import math
+import os
+import time
+
+PORT = os.environ.get("METRICS_PORT")
+HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Seconds, suited to HTTP requests and handlers.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for (label_values, child) in list(metric.children.items()):
+                labels = dict(zip(metric.labelnames, label_values))
+                lines.extend(child.samples(metric.name, labels))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def format_sample(name, labels, value):
+    if labels:
+        label_text = ",".join(
+            f'{key}="{_escape(str(label))}"' for (key, label) in labels.items()
+        )
+        name = f"{name}{{{label_text}}}"
+    return f"{name} {_format_value(value)}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = None
+    child_class = None
+
+    def __init__(self, name, help_text, labelnames=(), registry=REGISTRY, **options):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.options = options
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self.child_class(**options)
+        registry.register(self)
+
+    def labels(self, *label_values):
+        try:
+            return self.children[label_values]
+        except KeyError:
+            if len(label_values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self.children[label_values] = self.child_class(**self.options)
+            return child
+
+    # Unlabelled metrics can be used directly.
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    def set_function(self, function):
+        self.children[()].set_function(function)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield format_sample(name, labels, self.value)
+
+
+class Counter(Metric):
+    type = "counter"
+    child_class = _CounterChild
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set_function(self, function):
+        """
+        Read the value from function() whenever the metrics are scraped.
+        """
+        self.function = function
+
+    def samples(self, name, labels):
+        value = self.function() if self.function else self.value
+        yield format_sample(name, labels, value)
+
+
+class Gauge(Metric):
+    type = "gauge"
+    child_class = _GaugeChild
+
+
+class _Timer:
+    __slots__ = ("histogram", "started_at")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started_at)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, plus one for values above the last bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """
+        A context manager observing the seconds spent inside it.
+        """
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield format_sample(
+                f"{name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            )
+        yield format_sample(f"{name}_sum", labels, self.sum)
+        yield format_sample(f"{name}_count", labels, self.count)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    child_class = _HistogramChild
+
+
+# Metrics shared across the bots.
+
+UPDATES = Counter(
+    "bot_updates_total",
+    "Bot updates by what happened to them: enqueued, coalesced, sent or failed.",
+    ["event", "bot_type"],
+)
+HTTP_LATENCY = Histogram(
+    "http_request_seconds",
+    "Time taken by RC Together API requests.",
+    ["method", "endpoint"],
+)
+ENTITIES = Counter(
+    "websocket_entities_total", "Entities received from the websocket.", ["type"]
+)
+WEBSOCKET_MESSAGES = Counter(
+    "websocket_messages_total", "Websocket messages received, by type.", ["type"]
+)
+COMMAND_LATENCY = Histogram(
+    "agency_command_seconds", "Time taken to handle each Agency command.", ["command"]
+)
+QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in each queue.", ["queue"])
+
+
+# Serving the metrics.
+
+
+async def _handle(reader, writer, registry):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port=PORT, host=HOST, registry=REGISTRY):
+    """
+    Serve the metrics over HTTP at /metrics, if a port is configured.
+    Returns the asyncio server, or None.
+    """
+    if port is None:
+        return None
+    return await asyncio.start_server(
+        lambda reader, writer: _handle(reader, writer, registry), host, int(port)
+    )
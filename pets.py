@@ -9,10 +9,22 @@ import logging
 import asyncio
 import time
 
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
 import rctogether
-from bot import Bot
+import ingest
+import logs
+import metrics
+import ratelimit
+import retry
+import snapshot
+from journal import Journal
+from bot import Bot, UpdateScheduler
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 
 def parse_position(position):
@@ -53,6 +65,66 @@ class Region:
         return f"<Region {self.top_left!r} {self.bottom_right!r}>"
 
 
+GRID_CELL_SIZE = 8
+
+
+class SpatialGrid:
+    """
+    Things in the world, bucketed by position into square cells so that
+    neighbourhood and region queries only look at the cells they overlap.
+    """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells = defaultdict(set)
+        self._entries = {}
+
+    def _cell(self, pos):
+        return (pos["x"] // self.cell_size, pos["y"] // self.cell_size)
+
+    def add(self, key, item, pos):
+        """
+        Add an item at a position, or move it if it's already in the grid.
+        """
+        self.remove(key)
+        self._entries[key] = (item, pos)
+        self._cells[self._cell(pos)].add(key)
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        cell = self._cell(entry[1])
+        self._cells[cell].discard(key)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def in_box(self, top_left, bottom_right):
+        region = Region(top_left, bottom_right)
+        min_x, min_y = self._cell(top_left)
+        max_x, max_y = self._cell(bottom_right)
+
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                for key in self._cells.get((cell_x, cell_y), ()):
+                    item, pos = self._entries[key]
+                    if pos in region:
+                        yield item
+
+    def in_region(self, region):
+        return self.in_box(region.top_left, region.bottom_right)
+
+    def near(self, pos, distance=1):
+        return self.in_box(
+            offset_position(pos, {"x": -distance, "y": -distance}),
+            offset_position(pos, {"x": distance, "y": distance}),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+
 HELP_TEXT = textwrap.dedent(
     """\
         I can help you adopt a pet! Just send me a message saying 'adopt the <pet type> please'.
@@ -111,6 +183,14 @@ CORRAL = Region({"x": 0, "y": 40}, {"x": 19, "y": 58})
 
 PET_BOREDOM_TIMES = (3600, 5400)
 LURE_TIME_SECONDS = 600
+# Where the agency saves its state, so that a restart can carry on from it.
+SNAPSHOT_PATH = os.environ.get("PETS_SNAPSHOT_PATH")
+SNAPSHOT_INTERVAL = int(os.environ.get("PETS_SNAPSHOT_INTERVAL", 60))
+SNAPSHOT_VERSION = 1
+# Directory for the journal of adoptions, give-aways and so on.
+JOURNAL_DIR = os.environ.get("PETS_JOURNAL_DIR")
+# Avatar fields worth remembering across a restart.
+SNAPSHOT_AVATAR_FIELDS = ("id", "type", "person_name", "pos")
 DAY_CARE_CENTER = Region({"x": 0, "y": 62}, {"x": 11, "y": 74})
 
 SAD_MESSAGE_TEMPLATES = [
@@ -143,6 +223,8 @@ MANNERS = [
     "пожалуйста",
 ]
 
+MANNERS_PATTERN = re.compile("|".join(re.escape(please) for please in MANNERS))
+
 THANKS_RESPONSES = ["You're welcome!", "No problem!", "❤️"]
 
 
@@ -170,13 +252,83 @@ def response_handler(commands, pattern, include_mentions=False):
     return decorator
 
 
+def _literal_prefixes(parsed):
+    """
+    The literal text that any match of a parsed pattern starts with, as a list
+    of alternatives, or None if a match could start with anything.
+    """
+    prefix = ""
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            prefix += chr(av)
+            continue
+
+        if prefix:
+            break
+
+        if op is sre_parse.BRANCH:
+            alternatives = [_literal_prefixes(branch) for branch in av[1]]
+        elif op is sre_parse.SUBPATTERN:
+            alternatives = [_literal_prefixes(av[-1])]
+        else:
+            return None
+
+        if None in alternatives:
+            return None
+        return [text for texts in alternatives for text in texts]
+
+    return [prefix] if prefix else None
+
+
+class CommandDispatcher:
+    """
+    Finds the first command, in registration order, whose pattern matches a
+    message.
+
+    Patterns are compiled once. The literal text each pattern has to start with
+    is pulled out of it, so most commands are ruled out by a substring check on
+    the message before their regex is run.
+    """
+
+    def __init__(self, commands):
+        self._commands = []
+        for pattern, handler, include_mentions in commands:
+            keywords = _literal_prefixes(sre_parse.parse(pattern))
+            if keywords is not None:
+                keywords = [keyword.casefold() for keyword in keywords]
+            regex = re.compile(pattern, re.IGNORECASE)
+            self._commands.append((keywords, regex, handler, include_mentions))
+
+    def dispatch(self, text):
+        """
+        Returns (match, handler, include_mentions) for the first matching
+        command, or None.
+        """
+        folded = text.casefold()
+
+        for keywords, regex, handler, include_mentions in self._commands:
+            if keywords is not None:
+                for keyword in keywords:
+                    if keyword in folded:
+                        break
+                else:
+                    continue
+
+            match = regex.search(text)
+            if match:
+                return match, handler, include_mentions
+
+        return None
+
+
 async def reset_agency():
     async with rctogether.RestApiSession() as session:
         for bot in await rctogether.bots.get(session):
             if bot["emoji"] == "🧞":
                 pass
             elif not bot.get("message"):
-                print("Bot: ", bot)
+                logger.info("Deleting bot with no message: %s", bot)
+                await ratelimit.acquire("bots")
                 await rctogether.bots.delete(session, bot["id"])
 
 
@@ -190,11 +342,24 @@ class Pet(Bot):
                 self.is_in_day_care_center = True
         else:
             self.owner = None
+        self.type = self._parse_type()
 
-    @property
-    def type(self):
+    def _parse_type(self):
         return self.name.split(" ")[-1]
 
+    def update_data(self, data):
+        super().update_data(data)
+        self.type = self._parse_type()
+
+    def idle_timeout(self):
+        return random.randint(*PET_BOREDOM_TIMES)
+
+    def idle_update(self):
+        # Bored pets wander off to the corral, unless they're being looked after.
+        if self.owner and not self.is_in_day_care_center:
+            return CORRAL.random_point()
+        return None
+
     async def queued_updates(self):
         updates = super().queued_updates()
 
@@ -204,38 +369,60 @@ class Pet(Bot):
                 try:
                     update = await asyncio.wait_for(
                         asyncio.shield(next_update),
-                        timeout=random.randint(*PET_BOREDOM_TIMES),
+                        timeout=self.idle_timeout(),
                     )
                     yield update
                     break
                 except asyncio.TimeoutError:
-                    if self.owner and not self.is_in_day_care_center:
-                        yield CORRAL.random_point()
+                    update = self.idle_update()
+                    if update:
+                        yield update
                 except StopAsyncIteration:
                     return
 
 
+def _remove_from_index(index, key, pet):
+    pets = index[key]
+    pets.remove(pet)
+    if not pets:
+        del index[key]
+
+
 class PetDirectory:
     def __init__(self):
         self._available_pets = {}
         self._owned_pets = defaultdict(list)
         self._pets_by_id = {}
+        self._grid = SpatialGrid()
+        # (owner, type, is_in_day_care_center) -> pets, and type -> available pets.
+        self._owned_by_type = defaultdict(list)
+        self._available_by_type = defaultdict(list)
 
     def add(self, pet):
         self._pets_by_id[pet.id] = pet
+        self._grid.add(pet.id, pet, pet.pos)
 
         if pet.owner:
             self._owned_pets[pet.owner].append(pet)
+            self._owned_by_type[self._owned_key(pet)].append(pet)
         else:
             self._available_pets[position_tuple(pet.pos)] = pet
+            self._available_by_type[pet.type].append(pet)
 
     def remove(self, pet):
         del self._pets_by_id[pet.id]
+        self._grid.remove(pet.id)
 
         if pet.owner:
             self._owned_pets[pet.owner].remove(pet)
+            _remove_from_index(self._owned_by_type, self._owned_key(pet), pet)
         else:
             del self._available_pets[position_tuple(pet.pos)]
+            _remove_from_index(self._available_by_type, pet.type, pet)
+
+    @staticmethod
+    def _owned_key(pet):
+        return (pet.owner, pet.type, pet.is_in_day_care_center)
 
     def available(self):
         return self._available_pets.values()
@@ -246,6 +433,23 @@ class PetDirectory:
     def owned(self, owner_id):
         return self._owned_pets[owner_id]
 
+    def find_available(self, pet_type):
+        pets = self._available_by_type.get(pet_type)
+        return pets[0] if pets else None
+
+    def find_owned(self, owner_id, pet_type, in_day_care_center=None):
+        """
+        An owner's pet of the given type, either in or out of day care as
+        requested, or from anywhere if in_day_care_center is None.
+        """
+        if in_day_care_center is None:
+            return self.find_owned(owner_id, pet_type, False) or self.find_owned(
+                owner_id, pet_type, True
+            )
+
+        pets = self._owned_by_type.get((owner_id, pet_type, in_day_care_center))
+        return pets[0] if pets else None
+
     def __iter__(self):
         for pet in self._available_pets.values():
             yield pet
@@ -260,11 +464,36 @@ class PetDirectory:
     def __getitem__(self, pet_id):
         return self._pets_by_id[pet_id]
 
+    def __contains__(self, pet_id):
+        return pet_id in self._pets_by_id
+
     def set_owner(self, pet, owner):
         self.remove(pet)
         pet.owner = owner["id"]
         self.add(pet)
 
+    def set_day_care(self, pet, is_in_day_care_center):
+        self.remove(pet)
+        pet.is_in_day_care_center = is_in_day_care_center
+        self.add(pet)
+
+    def move(self, pet, pos):
+        if not pet.owner:
+            del self._available_pets[position_tuple(pet.pos)]
+            self._available_pets[position_tuple(pos)] = pet
+
+        pet.pos = pos
+        self._grid.add(pet.id, pet, pos)
+
+    def near(self, pos, distance=1):
+        """
+        Pets within distance of a position, including diagonally.
+        """
+        return self._grid.near(pos, distance)
+
+    def in_region(self, region):
+        return self._grid.in_region(region)
+
 
 class Agency:
     """
@@ -277,14 +506,28 @@ class Agency:
 
     commands = []
 
-    def __init__(self, session, genie, pet_directory):
+    def __init__(
+        self,
+        session,
+        genie,
+        pet_directory,
+        scheduler=None,
+        snapshot_path=None,
+        journal=None,
+    ):
         self.session = session
         self.genie = genie
         self.pet_directory = pet_directory
+        self.scheduler = scheduler
         self.lured_pets_by_petter = defaultdict(list)
         self.lured_pets = {}
         self.processed_message_dt = datetime.datetime.utcnow()
         self.avatars = {}
+        self.avatar_grid = SpatialGrid()
+        self.snapshot_path = snapshot_path
+        self.snapshot_task = None
+        # Where adoptions, give-aways and so on are recorded, if anywhere.
+        self.journal = journal
 
     async def __aenter__(self):
         return self
@@ -293,19 +536,40 @@ class Agency:
         await self.close()
 
     @classmethod
-    async def create(cls, session):
+    async def create(cls, session, snapshot_path=None, journal=None):
+        """
+        Build the agency from the live bot list. If there's a snapshot at
+        snapshot_path, it is loaded first and reconciled with the live bots,
+        and the agency keeps it up to date from then on.
+
+        Events are recorded in the journal, if given, starting with the
+        state the agency starts from.
+        """
         genie = None
         pet_directory = PetDirectory()
+        # All of the agency's bots share one task for sending updates.
+        scheduler = UpdateScheduler(session)
+
+        saved = snapshot.load(snapshot_path) if snapshot_path else None
+        if saved and saved.get("version") != SNAPSHOT_VERSION:
+            saved = None
+        saved_pets = {pet["id"]: pet for pet in saved["pets"]} if saved else {}
 
         for bot_json in await rctogether.bots.get(session):
             if bot_json["emoji"] == "🧞":
                 genie = Bot(bot_json)
-                genie.start_task(session)
-                print("Found the genie: ", bot_json)
+                genie.start_task(session, scheduler)
+                logger.info("Found the genie: %s", bot_json)
             else:
                 pet = Pet(bot_json)
+                saved_pet = saved_pets.get(pet.id)
+                # If the pet has said something since the snapshot, the
+                # snapshot is out of date and its message is the best guide.
+                if saved_pet and saved_pet["message"] == bot_json.get("message"):
+                    pet.owner = saved_pet["owner"]
+                    pet.is_in_day_care_center = saved_pet["in_day_care_center"]
                 pet_directory.add(pet)
-                pet.start_task(session)
+                pet.start_task(session, scheduler)
 
         if not genie:
             genie = await Bot.create(
@@ -315,22 +579,113 @@ class Agency:
                 x=GENIE_HOME["x"],
                 y=GENIE_HOME["y"],
                 can_be_mentioned=True,
+                scheduler=scheduler,
             )
 
-        agency = cls(session, genie, pet_directory)
+        agency = cls(session, genie, pet_directory, scheduler, snapshot_path, journal)
+        if saved:
+            agency.restore(saved)
+        agency.record(
+            "start",
+            bots=[genie.bot_json]
+            + [{**pet.bot_json, "pos": pet.pos} for pet in pet_directory],
+            pets=[
+                {
+                    "id": pet.id,
+                    "owner": pet.owner,
+                    "in_day_care_center": pet.is_in_day_care_center,
+                }
+                for pet in pet_directory
+            ],
+        )
+        if snapshot_path:
+            agency.snapshot_task = asyncio.create_task(
+                snapshot.save_periodically(
+                    snapshot_path, agency.snapshot, SNAPSHOT_INTERVAL
+                )
+            )
         return agency
 
+    def snapshot(self):
+        return {
+            "version": SNAPSHOT_VERSION,
+            "processed_message_dt": self.processed_message_dt.isoformat(),
+            "pets": [
+                {
+                    "id": pet.id,
+                    "message": pet.bot_json.get("message"),
+                    "owner": pet.owner,
+                    "in_day_care_center": pet.is_in_day_care_center,
+                }
+                for pet in self.pet_directory
+            ],
+            "lured_pets": list(self.lured_pets.items()),
+            "lured_pets_by_petter": [
+                (petter_id, [pet.id for pet in pets])
+                for (petter_id, pets) in self.lured_pets_by_petter.items()
+                if pets
+            ],
+            "avatars": [
+                {field: avatar[field] for field in SNAPSHOT_AVATAR_FIELDS}
+                for avatar in self.avatars.values()
+            ],
+        }
+
+    def restore(self, saved):
+        """
+        Restore state from a snapshot, skipping pets that no longer exist.
+        """
+        self.processed_message_dt = datetime.datetime.fromisoformat(
+            saved["processed_message_dt"]
+        )
+
+        now = time.time()
+        for (pet_id, lured_until) in saved["lured_pets"]:
+            if lured_until > now and pet_id in self.pet_directory:
+                self.lured_pets[pet_id] = lured_until
+        for (petter_id, pet_ids) in saved["lured_pets_by_petter"]:
+            pets = [
+                self.pet_directory[pet_id]
+                for pet_id in pet_ids
+                if pet_id in self.lured_pets
+            ]
+            if pets:
+                self.lured_pets_by_petter[petter_id] = pets
+
+        for avatar in saved["avatars"]:
+            self.avatars[avatar["id"]] = avatar
+            self.avatar_grid.add(avatar["id"], avatar, avatar["pos"])
+
+    def record(self, event_type, **fields):
+        if self.journal:
+            self.journal.append(event_type, **fields)
+
+    async def save_snapshot(self):
+        await snapshot.save_in_background(self.snapshot_path, self.snapshot())
+
     async def close(self):
+        if self.snapshot_task:
+            self.snapshot_task.cancel()
+        if self.snapshot_path:
+            await self.save_snapshot()
+
         if self.genie:
             await self.genie.close()
 
         for pet in self.pet_directory:
             await pet.close()
 
+        if self.scheduler:
+            await self.scheduler.close()
+
+        if self.journal:
+            self.journal.close()
+
     async def spawn_pet(self, pos):
-        pet = random.choice(PETS)
-        while any(x.emoji == pet["emoji"] for x in self.pet_directory.available()):
-            pet = random.choice(PETS)
+        not_in_stock = [
+            pet for pet in PETS if not self.pet_directory.find_available(pet["name"])
+        ]
+        pet = random.choice(not_in_stock or PETS)
 
         return await Pet.create(
             self.session,
@@ -338,19 +693,14 @@ class Agency:
             emoji=pet["emoji"],
             x=pos[0],
             y=pos[1],
+            scheduler=self.scheduler,
         )
 
     def get_non_day_care_center_owned_by_type(self, pet_name, owner):
-        for pet in self.pet_directory.owned(owner["id"]):
-            if pet.type == pet_name and not pet.is_in_day_care_center:
-                return pet
-        return None
+        return self.pet_directory.find_owned(owner["id"], pet_name, False)
 
     def get_from_day_care_center_by_type(self, pet_name, owner):
-        for pet in self.pet_directory.owned(owner["id"]):
-            if pet.type == pet_name and pet.is_in_day_care_center:
-                return pet
-        return None
+        return self.pet_directory.find_owned(owner["id"], pet_name, True)
 
     def get_random_from_day_care_center(self, owner):
         pets_in_day_care = [
@@ -367,9 +717,16 @@ class Agency:
 
     async def send_message(self, recipient, message_text, sender=None):
         sender = sender or self.genie
-        await rctogether.messages.send(
-            self.session, sender.id, f"@**{recipient['person_name']}** {message_text}"
-        )
+        text = f"@**{recipient['person_name']}** {message_text}"
+
+        async def send():
+            await ratelimit.acquire("messages")
+            with metrics.HTTP_LATENCY.labels("POST", "messages").time():
+                await rctogether.messages.send(self.session, sender.id, text)
+
+        # Messages can't be coalesced like moves, so transient failures are
+        # retried in place.
+        await retry.call(send)
 
     @response_handler(commands, "time to restock")
     async def handle_restock(self, restocker, match):
@@ -379,7 +736,9 @@ class Agency:
             )
             if pet:
                 self.pet_directory.remove(pet)
+                self.record("remove", pet=pet.id)
                 await pet.close()
+                await ratelimit.acquire("bots")
                 await rctogether.bots.delete(self.session, pet.id)
                 await self.send_message(
                     restocker,
@@ -389,11 +748,12 @@ class Agency:
         for pos in self.pet_directory.empty_spawn_points():
             pet = await self.spawn_pet(pos)
             self.pet_directory.add(pet)
+            self.record("spawn", bot=pet.bot_json)
         return "New pets now in stock!"
 
     @response_handler(commands, "adopt (a|an|the|one)? ([A-Za-z-]+)")
     async def handle_adoption(self, adopter, match):
-        if not any(please in match.string.lower() for please in MANNERS):
+        if not MANNERS_PATTERN.search(match.string.lower()):
             return "No please? Our pets are only available to polite homes."
 
         pet_name = match.groups()[1]
@@ -413,12 +773,7 @@ class Agency:
             except IndexError:
                 return "Sorry, we don't have any pets at the moment, perhaps it's time to restock?"
         else:
-            pet = next(
-                filter(
-                    lambda pet: pet.name == pet_name, self.pet_directory.available()
-                ),
-                None,
-            )
+            pet = self.pet_directory.find_available(pet_name)
 
         if not pet:
             try:
@@ -429,13 +784,12 @@ class Agency:
             return f"Sorry, we don't have {a_an(pet_name)} at the moment, perhaps you'd like {a_an(alternative)} instead?"
 
         await self.send_message(adopter, NOISES.get(pet.emoji, "💖"), pet)
-        await rctogether.bots.update(
-            self.session,
-            pet.id,
-            {"name": f"{adopter['person_name']}'s {pet.name}"},
-        )
+        name = f"{adopter['person_name']}'s {pet.name}"
+        await ratelimit.acquire("bots")
+        await rctogether.bots.update(self.session, pet.id, {"name": name})
 
         self.pet_directory.set_owner(pet, adopter)
+        self.record("adopt", pet=pet.id, owner=adopter["id"], name=name)
 
         return None
 
@@ -454,7 +808,8 @@ class Agency:
         await self.send_message(adopter, "Please don't forget about me!", pet)
         position = DAY_CARE_CENTER.random_point()
         await pet.update(position)
-        pet.is_in_day_care_center = True
+        self.pet_directory.set_day_care(pet, True)
+        self.record("day_care", pet=pet.id, in_day_care_center=True)
         return None
 
     @response_handler(commands, r"(?:collect|pick up|get) my ([A-Za-z]+)")
@@ -470,7 +825,8 @@ class Agency:
             return f"Sorry, you don't have {a_an(pet_name)} to collect. Would you like to collect your {suggested_alternative} instead?"
 
         await self.send_message(adopter, NOISES.get(pet.emoji, "💖"), pet)
-        pet.is_in_day_care_center = False
+        self.pet_directory.set_day_care(pet, False)
+        self.record("day_care", pet=pet.id, in_day_care_center=False)
 
     @response_handler(commands, "thank")
     async def handle_thanks(self, adopter, match):
@@ -479,14 +835,7 @@ class Agency:
     @response_handler(commands, r"abandon my ([A-Za-z-]+)")
     async def handle_abandonment(self, adopter, match):
         pet_name = match.groups()[0]
-        pet = next(
-            (
-                pet
-                for pet in self.pet_directory.owned(adopter["id"])
-                if pet.type == pet_name
-            ),
-            None,
-        )
+        pet = self.pet_directory.find_owned(adopter["id"], pet_name)
 
         if not pet:
             try:
@@ -496,11 +845,13 @@ class Agency:
             return f"Sorry, you don't have {a_an(pet_name)}. Would you like to abandon your {suggested_alternative} instead?"
 
         self.pet_directory.remove(pet)
+        self.record("abandon", pet=pet.id, owner=adopter["id"])
 
         # There may be unhandled updates in the pet's message queue - they don't matter because the exceptions will just be logged.
         # To be more correct we could push a delete event through the pet's queue.
         await pet.close()
         await self.send_message(adopter, sad_message(pet_name), pet)
+        await ratelimit.acquire("bots")
         await rctogether.bots.delete(self.session, pet.id)
         return None
 
@@ -518,22 +869,15 @@ class Agency:
 
         pet_type = match.group(1)
 
-        for pet in self.pet_directory.all_owned():
-            if is_adjacent(petter["pos"], pet.pos) and pet.type == pet_type:
+        for pet in self.pet_directory.near(petter["pos"]):
+            if pet.owner and pet.type == pet_type:
                 self.lured_pets[pet.id] = time.time() + LURE_TIME_SECONDS
                 self.lured_pets_by_petter[petter["id"]].append(pet)
 
     @response_handler(commands, r"give my ([A-Za-z]+) to", include_mentions=True)
     async def handle_give_pet(self, giver, match, mentioned_entities):
         pet_name = match.group(1)
-        pet = next(
-            (
-                pet
-                for pet in self.pet_directory.owned(giver["id"])
-                if pet.type == pet_name
-            ),
-            None,
-        )
+        pet = self.pet_directory.find_owned(giver["id"], pet_name)
 
         if not pet:
             try:
@@ -550,13 +894,14 @@ class Agency:
             return "Sorry, I don't know who that is! (Are they online?)"
 
         await self.send_message(recipient, NOISES.get(pet.emoji, "💖"), pet)
-        await rctogether.bots.update(
-            self.session,
-            pet.id,
-            {"name": f"{recipient['person_name']}'s {pet.name}"},
-        )
+        name = f"{recipient['person_name']}'s {pet.name}"
+        await ratelimit.acquire("bots")
+        await rctogether.bots.update(self.session, pet.id, {"name": name})
 
         self.pet_directory.set_owner(pet, recipient)
+        self.record(
+            "give", pet=pet.id, owner=recipient["id"], giver=giver["id"], name=name
+        )
         position = offset_position(recipient["pos"], random.choice(DELTAS))
         await pet.update(position)
         return
@@ -565,10 +910,13 @@ class Agency:
     async def handle_help(self, adopter, match):
         return HELP_TEXT
 
+    dispatcher = CommandDispatcher(commands)
+
     async def handle_mention(self, adopter, message, mentioned_entity_ids):
-        for (pattern, handler, include_mentions) in self.commands:
-            match = re.search(pattern, message["text"], re.IGNORECASE)
-            if match:
+        command = self.dispatcher.dispatch(message["text"])
+        if command:
+            match, handler, include_mentions = command
+            with metrics.COMMAND_LATENCY.labels(handler.__name__).time():
                 if include_mentions:
                     response = await handler(
                         self,
@@ -578,70 +926,139 @@ class Agency:
                     )
                 else:
                     response = await handler(self, adopter, match)
-                if response:
-                    await self.send_message(adopter, response)
-                return
+            if response:
+                await self.send_message(adopter, response)
+            return
 
         await self.send_message(
             adopter, "Sorry, I don't understand. Would you like to adopt a pet?"
         )
 
     async def handle_entity(self, entity):
-        if entity["type"] == "Avatar":
-            self.avatars[entity["id"]] = entity
-
-            message = entity.get("message")
-
-            if message and self.genie.id in message["mentioned_entity_ids"]:
-                message_dt = datetime.datetime.strptime(
-                    message["sent_at"], "%Y-%m-%dT%H:%M:%SZ"
+        await self.handle_entities([entity])
+
+    async def handle_entities(self, entities):
+        """
+        Process a batch of entities, such as a world snapshot, in one pass.
+
+        Positions are recorded first, then any mentions of the genie are
+        answered, then each avatar's pets are sent one move towards the
+        avatar's latest position.
+        """
+        avatars = {}
+        mentions = []
+
+        for entity in entities:
+            if entity["type"] == "Avatar":
+                self.avatars[entity["id"]] = entity
+                self.avatar_grid.add(entity["id"], entity, entity["pos"])
+                avatars[entity["id"]] = entity
+
+                message = entity.get("message")
+                if message and self.genie.id in message["mentioned_entity_ids"]:
+                    mentions.append((entity, message))
+
+            if entity["type"] == "Bot":
+                try:
+                    pet = self.pet_directory[entity["id"]]
+                except KeyError:
+                    pass
+                else:
+                    # Keep the pet's latest message, which a snapshot compares
+                    # with the live bot on restart.
+                    pet.update_data({**pet.bot_json, **entity})
+                    self.pet_directory.move(pet, entity["pos"])
+
+        for (entity, message) in mentions:
+            message_dt = datetime.datetime.strptime(
+                message["sent_at"], "%Y-%m-%dT%H:%M:%SZ"
+            )
+            if message_dt > self.processed_message_dt:
+                self.record("mention", entity=entity)
+                await self.handle_mention(
+                    entity, message, message["mentioned_entity_ids"]
                 )
-                if message_dt > self.processed_message_dt:
-                    await self.handle_mention(
-                        entity, message, message["mentioned_entity_ids"]
-                    )
-                    self.processed_message_dt = message_dt
+                self.processed_message_dt = message_dt
+
+        moves = {}
+        for avatar in avatars.values():
+            self.follow(avatar, moves)
+
+        for (pet, position) in moves.values():
+            await pet.update(position)
+
+    def follow(self, avatar, moves):
+        """
+        Plan moves for the pets following an avatar, adding them to moves.
+        """
+        for pet in self.lured_pets_by_petter.get(avatar["id"], []):
+            position = offset_position(avatar["pos"], random.choice(DELTAS))
+            moves[pet.id] = (pet, position)
+
+        for pet in self.pet_directory.owned(avatar["id"]):
+            if pet.is_in_day_care_center:
+                continue
+            if pet.id in self.lured_pets:
+                if self.lured_pets[pet.id] < time.time():  # if timer is expired
+                    del self.lured_pets[pet.id]
+                    for petter_id in self.lured_pets_by_petter:
+                        for lured_pet in self.lured_pets_by_petter[petter_id]:
+                            if lured_pet.id == pet.id:
+                                self.lured_pets_by_petter[petter_id].remove(lured_pet)
+                else:
+                    continue
+            position = offset_position(avatar["pos"], random.choice(DELTAS))
+            moves[pet.id] = (pet, position)
 
-        if entity["type"] == "Avatar":
-            for pet in self.lured_pets_by_petter.get(entity["id"], []):
-                position = offset_position(entity["pos"], random.choice(DELTAS))
-                await pet.update(position)
 
-            for pet in self.pet_directory.owned(entity["id"]):
-                if pet.is_in_day_care_center:
-                    continue
-                if pet.id in self.lured_pets:
-                    if self.lured_pets[pet.id] < time.time():  # if timer is expired
-                        del self.lured_pets[pet.id]
-                        for petter_id in self.lured_pets_by_petter:
-                            for lured_pet in self.lured_pets_by_petter[petter_id]:
-                                if lured_pet.id == pet.id:
-                                    self.lured_pets_by_petter[petter_id].remove(
-                                        lured_pet
-                                    )
-                    else:
-                        continue
-                position = offset_position(entity["pos"], random.choice(DELTAS))
-                await pet.update(position)
-
-        if entity["type"] == "Bot":
-            try:
-                pet = self.pet_directory[entity["id"]]
-            except KeyError:
-                pass
-            else:
-                pet.pos = entity["pos"]
+def replay(events):
+    """
+    Rebuild a PetDirectory from journal events, as it was after the last one.
+    """
+    pet_directory = PetDirectory()
+
+    for event in events:
+        event_type = event["type"]
+        if event_type == "start":
+            pet_directory = PetDirectory()
+            states = {state["id"]: state for state in event["pets"]}
+            for bot_json in event["bots"]:
+                state = states.get(bot_json["id"])
+                if state:
+                    pet = Pet(bot_json)
+                    pet.owner = state["owner"]
+                    pet.is_in_day_care_center = state["in_day_care_center"]
+                    pet_directory.add(pet)
+        elif event_type == "spawn":
+            pet_directory.add(Pet(event["bot"]))
+        elif event_type in ("adopt", "give"):
+            pet = pet_directory[event["pet"]]
+            pet_directory.set_owner(pet, {"id": event["owner"]})
+            pet.update_data({**pet.bot_json, "name": event["name"]})
+        elif event_type == "day_care":
+            pet_directory.set_day_care(
+                pet_directory[event["pet"]], event["in_day_care_center"]
+            )
+        elif event_type in ("abandon", "remove"):
+            pet_directory.remove(pet_directory[event["pet"]])
+
+    return pet_directory
 
 
 DELTAS = [{"x": x, "y": y} for x in [-1, 0, 1] for y in [-1, 0, 1] if x != 0 or y != 0]
 
 
 async def main():
+    logs.configure()
+    await metrics.serve()
     async with rctogether.RestApiSession() as session:
-        agency = await Agency.create(session)
-
-        async for entity in rctogether.WebsocketSubscription():
-            await agency.handle_entity(entity)
+        journal = Journal(JOURNAL_DIR) if JOURNAL_DIR else None
+        async with await Agency.create(session, SNAPSHOT_PATH, journal) as agency:
+            await ingest.process(
+                rctogether.WebsocketSubscription(),
+                agency.handle_entities,
+                stats_interval=60,
+            )
 
 
 if __name__ == "__main__":
@@ -1,6 +1,11 @@
 import random
 import asyncio
+import logging
+
 import arctogether
+import logs
+
+logger = logging.getLogger(__name__)
 
 TARGET = {"x": 160, "y": 3}
 PARTICLE_HOME = {"x": 160, "y": 10}
@@ -14,22 +19,33 @@ class RealityLab:
         self.target_id = None
 
     async def handle_entity(self, entity):
-        if entity["pos"] == {"x": 158, "y": 3} and entity.get("person_name") == "Adam Kelly":
-            print("Initialise sequence!")
-            asyncio.create_task(self.run_sequence())
-
-        if entity["pos"] == TARGET:
-            print("TARGET ACQUIRED: ", entity)
-            if self.particle:
-                await self.particle.update(TARGET)
-                self.target_id = entity["id"]
-        elif entity["id"] == self.target_id and entity["pos"] != TARGET:
-            print("Target gone - reset.")
-            await self.particle.update(PARTICLE_HOME)
-            self.target_id = None
+        await self.handle_entities([entity])
+
+    async def handle_entities(self, entities):
+        particle_move = None
+
+        for entity in entities:
+            if entity["pos"] == {"x": 158, "y": 3} and entity.get("person_name") == "Adam Kelly":
+                logger.info("Initialise sequence!")
+                asyncio.create_task(self.run_sequence())
+
+            if entity["pos"] == TARGET:
+                logger.info("TARGET ACQUIRED: %s", entity)
+                if self.particle:
+                    particle_move = TARGET
+                    self.target_id = entity["id"]
+            elif entity["id"] == self.target_id and entity["pos"] != TARGET:
+                logger.info("Target gone - reset.")
+                particle_move = PARTICLE_HOME
+                self.target_id = None
+
+        if particle_move:
+            await self.particle.update(particle_move)
 
     async def handle_particle_move(self, entity):
-        print("Particle move: ", entity, self.target_id, TARGET)
+        logger.debug(
+            "Particle move: %s, %s, %s", entity, self.target_id, TARGET, extra=logs.SAMPLED
+        )
 
         if self.target_id:
             return
@@ -60,7 +76,7 @@ class RealityLab:
     async def start(self):
         await arctogether.clean_up_bots()
 
-        self.rc = arctogether.RcTogether(callbacks=[self.handle_entity])
+        self.rc = arctogether.RcTogether(batch_callbacks=[self.handle_entities])
 
         self.particle = await self.rc.create_bot(
             name="Particle",
@@ -74,4 +90,5 @@ class RealityLab:
 
 
 if __name__ == "__main__":
+    logs.configure()
     asyncio.run(RealityLab().start())
@@ -0,0 +1,91 @@
+"""
+Process-wide rate limiting for requests to the RC Together API.
+
+Every request draws a token from the bucket for its endpoint ("bots" or
+"messages"), so the aggregate request rate stays within budget however many
+bots are running. Tokens are handed out in the order they are asked for, and
+nobody waits while there are tokens to spare.
+"""
+
+import asyncio
+import os
+import time
+
+
+def _budget(endpoint, rate, burst):
+    prefix = f"RC_{endpoint.upper()}"
+    return (
+        float(os.environ.get(f"{prefix}_RATE", rate)),
+        int(os.environ.get(f"{prefix}_BURST", burst)),
+    )
+
+
+# Requests per second and burst size for each endpoint.
+BUDGETS = {
+    "bots": _budget("bots", 20, 20),
+    "messages": _budget("messages", 5, 5),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self):
+        """
+        Take a token, returning how many seconds the caller must wait before
+        using it. The bucket may go into debt: later callers queue up behind
+        earlier ones rather than competing for the next token.
+        """
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def try_take(self):
+        """
+        Take a token only if one is available now, as a server enforcing the
+        limit would. Returns 0 if a token was taken, otherwise the seconds
+        until one will be.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class RateLimiter:
+    def __init__(self, budgets=BUDGETS):
+        self.buckets = {}
+        for endpoint, (rate, burst) in budgets.items():
+            self.configure(endpoint, rate, burst)
+
+    def configure(self, endpoint, rate, burst):
+        self.buckets[endpoint] = TokenBucket(rate, burst)
+
+    async def acquire(self, endpoint):
+        bucket = self.buckets.get(endpoint)
+        if bucket:
+            await bucket.acquire()
+
+
+limiter = RateLimiter()
+
+
+async def acquire(endpoint):
+    await limiter.acquire(endpoint)
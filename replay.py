@@ -0,0 +1,59 @@
+"""
+Rebuild the pet agency's state from its journal, without asking the API.
+
+    python replay.py JOURNAL_DIR [--traffic FILE]
+
+Prints a summary of the rebuilt pets. With --traffic, also writes the bots
+the agency last started with and the mentions it has handled since, as JSON
+with "bots" and "entities" keys: enough to replay real traffic through an
+Agency with a mock session, as test_pets.py does.
+"""
+
+import argparse
+import collections
+import json
+import time
+
+import journal
+import pets
+
+
+def traffic(events):
+    bots = []
+    entities = []
+    for event in events:
+        if event["type"] == "start":
+            bots = event["bots"]
+            entities = []
+        elif event["type"] == "mention":
+            entities.append(event["entity"])
+    return {"bots": bots, "entities": entities}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("journal_dir")
+    parser.add_argument("--traffic", help="file to write replayable traffic to")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    events = list(journal.read(args.journal_dir))
+    pet_directory = pets.replay(events)
+    elapsed = time.perf_counter() - started_at
+
+    owned = list(pet_directory.all_owned())
+    by_type = collections.Counter(pet.type for pet in owned)
+    print(f"Replayed {len(events)} events in {elapsed:.3f}s")
+    print(f"Available pets: {len(list(pet_directory.available()))}")
+    print(f"Owned pets: {len(owned)}")
+    print(f"In day care: {sum(1 for pet in owned if pet.is_in_day_care_center)}")
+    for (pet_type, count) in by_type.most_common():
+        print(f"  {pet_type}: {count}")
+
+    if args.traffic:
+        with open(args.traffic, "w", encoding="utf-8") as traffic_file:
+            json.dump(traffic(events), traffic_file, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
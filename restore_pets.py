@@ -1,6 +1,7 @@
 import asyncio
 import rctogether
 import pets
+import bulk
 
 EMOJI = {pet['name']: pet['emoji'] for pet in pets.PETS}
 EMOJI['sheep'] = "🐑"
@@ -9,6 +10,7 @@ EMOJI['duck'] = "🦆"
 async def main():
     async with rctogether.RestApiSession() as session:
         bots = await rctogether.bots.get(session)
+        updates = {}
         for bot in bots:
             if bot['emoji'] == '🧞':
                 continue
@@ -19,8 +21,12 @@ async def main():
             if original_emoji and original_emoji != bot['emoji']:
                 print(bot)
                 print(pet_type, bot['emoji'], original_emoji)
-                await rctogether.bots.update(session, bot['id'], {'emoji': original_emoji})
-                await asyncio.sleep(0.2)
+                updates[bot['id']] = {'emoji': original_emoji}
+
+        report = await bulk.bulk_update(session, updates, progress=bulk.print_progress)
+        print(report)
+        for bot_id, exc in report.failures.items():
+            print("Failed: ", bot_id, exc)
 
 if __name__ == "__main__":
     asyncio.run(main())
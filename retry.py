@@ -0,0 +1,126 @@
+"""
+Retry policy for requests to the RC Together API.
+
+Failures are sorted into classes: rate limited (429), server errors (5xx) and
+network errors are worth retrying, while any other client error (a 404 for a
+deleted bot, say) will fail the same way every time. Each retryable class has
+its own attempt limit. The wait before a retry grows exponentially with full
+jitter, so bots that failed together don't all retry together, and a server's
+Retry-After is honoured when it gives one.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import time
+
+import aiohttp
+import rctogether
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = "rate_limited"
+SERVER_ERROR = "server_error"
+NETWORK_ERROR = "network_error"
+
+# Attempts allowed in total, including the first, for each class of failure.
+# Failures of any other class are not retried.
+RULES = {
+    RATE_LIMITED: 6,
+    SERVER_ERROR: 3,
+    NETWORK_ERROR: 3,
+}
+
+# Seconds to wait before the first retry, doubling with each attempt after
+# that, up to MAX_DELAY.
+BASE_DELAY = 1
+MAX_DELAY = 30
+
+
+# Failures an update or request might end with, retryable or not.
+ERRORS = (rctogether.api.HttpError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header, which is either a number of
+    seconds or an HTTP date. Returns None if the value can't be understood.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def classify(exc):
+    if isinstance(exc, rctogether.api.HttpError):
+        status = exc.args[0] if exc.args else None
+        if status == 429:
+            return RATE_LIMITED
+        if isinstance(status, int) and status >= 500:
+            return SERVER_ERROR
+        return None
+    if isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return NETWORK_ERROR
+    return None
+
+
+class RetryPolicy:
+    def __init__(
+        self, rules=RULES, base_delay=BASE_DELAY, max_delay=MAX_DELAY, rng=random
+    ):
+        self.rules = rules
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng
+
+    def is_retryable(self, exc):
+        return classify(exc) in self.rules
+
+    def delay(self, exc, attempt):
+        """
+        Seconds to wait before retrying after the given attempt (counting from
+        1) failed with exc, or None if it shouldn't be retried.
+        """
+        attempts = self.rules.get(classify(exc))
+        if attempts is None or attempt >= attempts:
+            return None
+
+        retry_after = getattr(exc, "retry_after", None)
+        if retry_after is not None:
+            # Spread out the bots that were all told the same time.
+            return retry_after + self.rng.uniform(0, self.base_delay)
+
+        return self.rng.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+
+default_policy = RetryPolicy()
+
+
+async def call(request, *args, policy=None, **kwargs):
+    """
+    Await request(*args, **kwargs), retrying failures the policy allows.
+    The last failure is raised once the policy gives up.
+    """
+    policy = policy or default_policy
+    attempt = 1
+    while True:
+        try:
+            return await request(*args, **kwargs)
+        except Exception as exc:  # pylint: disable=broad-except
+            delay = policy.delay(exc, attempt)
+            if delay is None:
+                raise
+            logger.info("Retrying in %.1fs after %r", delay, exc)
+            await asyncio.sleep(delay)
+            attempt += 1
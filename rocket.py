@@ -3,9 +3,13 @@ import random
 import asyncio
 
 import rctogether
-from bot import Bot
+import ingest
+import logs
+import metrics
+import ratelimit
+from bot import Bot, merge_update
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Launch station. (Where the rocket starts.)
 # Control computer. (Note block check for name.)
@@ -64,6 +68,7 @@ class Bot:
 
     @classmethod
     async def create(cls, session, name, emoji, x, y):
+        await ratelimit.acquire("bots")
         bot_json = await rctogether.bots.create(
             session, name=name, emoji=emoji, x=x, y=y
         )
@@ -80,16 +85,26 @@ class Bot:
         return self.bot_json["id"]
 
     async def run(self, session):
+        loop = asyncio.get_running_loop()
+
         while True:
             update = await self.queue.get()
 
+            # Merge queued updates so that, say, a debris emoji change isn't
+            # lost when a move follows it.
             while update is not None and not self.queue.empty():
-                print("Skipping outdated update: ", update)
-                update = await self.queue.get()
+                next_update = await self.queue.get()
+                if next_update is None:
+                    update = None
+                else:
+                    update = merge_update(update, next_update)
+
+            await ratelimit.acquire("bots")
+            next_update_at = loop.time() + 1
 
-            print("Applying update: ", update)
+            logger.debug("Applying update: %s", update, extra=logs.SAMPLED)
             await rctogether.bots.update(session, self.id, update)
-            await asyncio.sleep(1)
+            await asyncio.sleep(next_update_at - loop.time())
 
     async def update(self, update):
         await self.queue.put(update)
@@ -116,7 +131,7 @@ class ClankyBotLauchSystem:
         )
         gc_bot = await GarbageCollectionBot.create(session)
 
-        print("Rocket is : ", rocket)
+        logger.info("Rocket is: %s", rocket)
         return cls(session, rocket, gc_bot)
 
     async def respawn_rocket(self):
@@ -131,7 +146,7 @@ class ClankyBotLauchSystem:
         self.target = "Nobody"
 
     async def handle_instruction(self, entity):
-        print("New instructions received: ", entity)
+        logger.info("New instructions received: %s", entity)
         note_text = entity.get("note_text")
         if note_text == "":
             self.instigator = None
@@ -148,7 +163,9 @@ class ClankyBotLauchSystem:
         rocket_position = entity["pos"]
         target_position = TARGETS.get(self.target)
 
-        print("TARGET HIT: ", rocket_position, target_position)
+        logger.debug(
+            "Rocket moved: %s, target at: %s", rocket_position, target_position
+        )
         if rocket_position == target_position:
             emoji = random.choice(list(PAYLOADS))
             await self.rocket.update(
@@ -162,25 +179,39 @@ class ClankyBotLauchSystem:
 
     async def handle_target_detected(self, entity):
         target_position = entity["pos"]
-        print("Target detected at: ", target_position)
+        logger.debug("Target detected at: %s", target_position, extra=logs.SAMPLED)
         await self.rocket.update(target_position)
 
     async def handle_entity(self, entity):
-        person_name = normalise_name(entity.get("person_name"))
-        if person_name:
-            TARGETS[person_name] = entity["pos"]
+        await self.handle_entities([entity])
+
+    async def handle_entities(self, entities):
+        """
+        Process a batch of entities, such as a world snapshot. Target positions
+        are all recorded before the rocket is sent after its target, once.
+        """
+        people = {}
 
-        if person_name == self.target:
-            await self.handle_target_detected(entity)
+        for entity in entities:
+            person_name = normalise_name(entity.get("person_name"))
+            if person_name:
+                TARGETS[person_name] = entity["pos"]
+                people[person_name] = entity
 
-        elif entity.get("pos") == {"x": 27, "y": 61}:
-            await self.handle_instruction(entity)
+            if person_name == self.target:
+                continue
 
-        elif entity["id"] == self.rocket.id:
-            await self.handle_rocket_move(entity)
+            if entity.get("pos") == {"x": 27, "y": 61}:
+                await self.handle_instruction(entity)
 
-        elif entity["id"] == self.gc_bot.id:
-            self.gc_bot.handle_update(entity)
+            elif entity["id"] == self.rocket.id:
+                await self.handle_rocket_move(entity)
+
+            elif entity["id"] == self.gc_bot.id:
+                self.gc_bot.handle_update(entity)
+
+        if self.target in people:
+            await self.handle_target_detected(people[self.target])
 
 
 class GarbageCollectionBot:
@@ -204,7 +235,7 @@ class GarbageCollectionBot:
             if self.garbage_queue.qsize() <= 0:
                 await asyncio.sleep(60)
             elif self.garbage:
-                print("Hey, we're already busy here.")
+                logger.info("Hey, we're already busy here.")
                 await asyncio.sleep(60)
             else:
                 await self.collect(await self.garbage_queue.get())
@@ -218,32 +249,35 @@ class GarbageCollectionBot:
 
     async def collect(self, garbage):
         self.garbage = garbage
-        print("Crew dispatched to collect: ", self.garbage)
+        logger.info("Crew dispatched to collect: %s", self.garbage)
         await self.garbage_bot.update(self.garbage.pos)
 
     async def complete_collection(self):
         await asyncio.sleep(15)
-        print("Ready to complete collection!")
+        logger.info("Ready to complete collection!")
         await self.garbage.destroy(self.session)
         self.garbage = None
         await self.garbage_bot.update({"x": 22, "y": 61})
 
     def handle_update(self, entity):
         if self.garbage and entity["pos"] == self.garbage.pos:
-            print("Collection complete: ", entity, self.garbage)
+            logger.info("Collection complete: %s, %s", entity, self.garbage)
             asyncio.create_task(self.complete_collection())
 
 
 async def main():
+    logs.configure()
+    await metrics.serve()
     async with rctogether.RestApiSession() as session:
         try:
             await rctogether.bots.delete_all(session)
 
             launch_system = await ClankyBotLauchSystem.create(session)
-            async for entity in rctogether.WebsocketSubscription():
-                await launch_system.handle_entity(entity)
+            await ingest.process(
+                rctogether.WebsocketSubscription(), launch_system.handle_entities
+            )
         finally:
-            print("Exitting... cleaning up.")
+            logger.info("Exiting... cleaning up.")
             await rctogether.bots.delete_all(session)
 
 
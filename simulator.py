@@ -0,0 +1,421 @@
+"""
+An offline, in-process stand-in for the RC Together API.
+
+A World is a grid of avatars walking at random and sending messages, plus
+whatever bots are created in it. It serves the REST API with the same
+methods as rctogether.RestApiSession and arctogether.ApiClient, optionally
+with latency, injected failures and server-side rate limits (answered with
+429s and a Retry-After), and streams entity updates like the websocket.
+The pet agency, the rocket and the reality lab run against it unchanged:
+
+    python simulator.py pets --avatars 10000 --moves 2000 --seconds 30
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import os
+import random
+import re
+import time
+
+import rctogether
+
+import ingest
+import logs
+import ratelimit
+
+WIDTH = 200
+HEIGHT = 100
+# How often the world moves avatars and sends messages, in seconds.
+TICK = 0.05
+
+MENTION_PATTERN = re.compile(r"@\*\*(.+?)\*\*")
+
+
+class HttpError(rctogether.api.HttpError):
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(status, body)
+        self.retry_after = retry_after
+
+
+def timestamp():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class World:
+    def __init__(
+        self,
+        width=WIDTH,
+        height=HEIGHT,
+        avatars=0,
+        moves_per_second=0,
+        messages_per_second=0,
+        message_texts=("hello!",),
+        latency=0,
+        jitter=0,
+        error_rate=0,
+        rate_limits=None,
+        seed=None,
+    ):
+        """
+        moves_per_second and messages_per_second are totals across all
+        avatars. Messages mention the bots that can be mentioned. Requests
+        take latency plus up to jitter seconds, fail with a 503 at the given
+        rate, and are limited per resource by rate_limits, which maps
+        resource to (requests per second, burst) as in ratelimit.BUDGETS.
+        """
+        self.width = width
+        self.height = height
+        self.moves_per_second = moves_per_second
+        self.messages_per_second = messages_per_second
+        self.message_texts = message_texts
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.buckets = {
+            resource: ratelimit.TokenBucket(rate, burst)
+            for (resource, (rate, burst)) in (rate_limits or {}).items()
+        }
+        self.random = random.Random(seed)
+
+        self.entities_by_id = {}
+        self._ids = itertools.count(1)
+        self._avatar_ids = []
+        self._avatar_ids_by_name = {}
+        self._mentionable = set()
+        self._subscribers = set()
+        self._task = None
+
+        self.requests = collections.Counter()
+        self.rejected = 0
+        self.failed = 0
+        self.published = 0
+
+        for n in range(avatars):
+            self.add_avatar(f"Avatar {n}")
+
+    def stats(self):
+        return {
+            "entities": len(self.entities_by_id),
+            "published": self.published,
+            "requests": dict(self.requests),
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+    def random_pos(self):
+        return {
+            "x": self.random.randrange(self.width),
+            "y": self.random.randrange(self.height),
+        }
+
+    def add_avatar(self, person_name, pos=None):
+        avatar = {
+            "type": "Avatar",
+            "id": next(self._ids),
+            "person_name": person_name,
+            "pos": pos or self.random_pos(),
+        }
+        self.entities_by_id[avatar["id"]] = avatar
+        self._avatar_ids.append(avatar["id"])
+        self._avatar_ids_by_name[person_name] = avatar["id"]
+        self._publish(avatar)
+        return avatar
+
+    def move(self, entity_id, pos):
+        entity = self.entities_by_id[entity_id]
+        entity["pos"] = {"x": pos["x"], "y": pos["y"]}
+        self._publish(entity)
+
+    def say(self, entity_id, text, mentioned_entity_ids=None):
+        """
+        Send a message from an avatar or bot. Unless given, the mentioned
+        entities are found from @**name** mentions in the text.
+        """
+        if mentioned_entity_ids is None:
+            mentioned_entity_ids = self._mentions(text)
+
+        entity = self.entities_by_id[entity_id]
+        entity["message"] = {
+            "text": text,
+            "mentioned_entity_ids": mentioned_entity_ids,
+            "sent_at": timestamp(),
+        }
+        self._publish(entity)
+
+    def _mentions(self, text):
+        return [
+            self._avatar_ids_by_name[name]
+            for name in MENTION_PATTERN.findall(text)
+            if name in self._avatar_ids_by_name
+        ]
+
+    def _publish(self, entity):
+        self.published += 1
+        if self._subscribers:
+            update = dict(entity)
+            for subscriber in self._subscribers:
+                subscriber.put_nowait(update)
+
+    async def entities(self):
+        """
+        The websocket's view of the world: every entity, then each update
+        as it happens, until the world stops.
+        """
+        subscriber = asyncio.Queue()
+        self._subscribers.add(subscriber)
+        try:
+            for entity in list(self.entities_by_id.values()):
+                yield dict(entity)
+
+            while True:
+                entity = await subscriber.get()
+                if entity is None:
+                    return
+                yield entity
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for subscriber in self._subscribers:
+            subscriber.put_nowait(None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # Fractional moves and messages carried over between ticks.
+        moves = messages = 0.0
+        last_tick = loop.time()
+
+        while True:
+            await asyncio.sleep(TICK)
+            now = loop.time()
+            elapsed, last_tick = now - last_tick, now
+
+            moves += self.moves_per_second * elapsed
+            messages += self.messages_per_second * elapsed
+            if not self._avatar_ids:
+                continue
+
+            while moves >= 1:
+                moves -= 1
+                self.walk(self.random.choice(self._avatar_ids))
+
+            while messages >= 1:
+                messages -= 1
+                if self._mentionable:
+                    self.say(
+                        self.random.choice(self._avatar_ids),
+                        self.random.choice(self.message_texts),
+                        [self.random.choice(sorted(self._mentionable))],
+                    )
+
+    def walk(self, entity_id):
+        pos = self.entities_by_id[entity_id]["pos"]
+        step = self.random.randint
+        self.move(
+            entity_id,
+            {
+                "x": min(self.width - 1, max(0, pos["x"] + step(-1, 1))),
+                "y": min(self.height - 1, max(0, pos["y"] + step(-1, 1))),
+            },
+        )
+
+    # The REST API.
+
+    async def _request(self, method, resource):
+        self.requests[(method, resource)] += 1
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        bucket = self.buckets.get(resource)
+        if bucket:
+            retry_after = bucket.try_take()
+            if retry_after:
+                self.rejected += 1
+                raise HttpError(429, "Too Many Requests", retry_after)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.failed += 1
+            raise HttpError(503, "Service Unavailable")
+
+    def _bot(self, bot_id):
+        bot = self.entities_by_id.get(bot_id)
+        if bot is None or bot["type"] != "Bot":
+            raise HttpError(404, "Not Found")
+        return bot
+
+    async def get(self, resource):
+        await self._request("get", resource)
+        if resource != "bots":
+            raise HttpError(404, "Not Found")
+        return [
+            dict(entity)
+            for entity in self.entities_by_id.values()
+            if entity["type"] == "Bot"
+        ]
+
+    async def post(self, resource, json):
+        await self._request("post", resource)
+
+        if resource == "bots":
+            attributes = json["bot"]
+            bot = {
+                "type": "Bot",
+                "id": next(self._ids),
+                "name": attributes["name"],
+                "emoji": attributes.get("emoji", "🤖"),
+                "pos": {"x": attributes["x"], "y": attributes["y"]},
+                "direction": attributes.get("direction", "right"),
+                "can_be_mentioned": attributes.get("can_be_mentioned", False),
+            }
+            self.entities_by_id[bot["id"]] = bot
+            if bot["can_be_mentioned"]:
+                self._mentionable.add(bot["id"])
+            self._publish(bot)
+            return dict(bot)
+
+        if resource == "messages":
+            self._bot(json["bot_id"])
+            self.say(json["bot_id"], json["text"])
+            return {}
+
+        raise HttpError(404, "Not Found")
+
+    async def patch(self, resource, resource_id, json):
+        await self._request("patch", resource)
+        bot = self._bot(resource_id)
+
+        attributes = dict(json["bot"])
+        if "x" in attributes or "y" in attributes:
+            bot["pos"] = {
+                "x": attributes.pop("x", bot["pos"]["x"]),
+                "y": attributes.pop("y", bot["pos"]["y"]),
+            }
+        bot.update(attributes)
+        self._publish(bot)
+        return dict(bot)
+
+    async def delete(self, resource, resource_id, json=None):
+        await self._request("delete", resource)
+        bot = self._bot(resource_id)
+        del self.entities_by_id[bot["id"]]
+        self._mentionable.discard(bot["id"])
+        return {}
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+# Running the bots against a world.
+
+
+async def run_pets(world):
+    import pets  # pylint: disable=import-outside-toplevel
+
+    async with await pets.Agency.create(world) as agency:
+        return await ingest.process(world.entities(), agency.handle_entities)
+
+
+async def run_rocket(world):
+    import rocket  # pylint: disable=import-outside-toplevel
+
+    launch_system = await rocket.ClankyBotLauchSystem.create(world)
+    return await ingest.process(world.entities(), launch_system.handle_entities)
+
+
+async def run_quantum(world):
+    # arctogether reads its credentials on import, though they go unused here.
+    os.environ.setdefault("RC_APP_ID", "simulator")
+    os.environ.setdefault("RC_APP_SECRET", "simulator")
+    import arctogether  # pylint: disable=import-outside-toplevel
+    import quantum  # pylint: disable=import-outside-toplevel
+
+    arctogether.default_client = world
+    arctogether.default_source = world.entities
+    await quantum.RealityLab().start()
+
+
+APPS = {
+    "pets": (
+        run_pets,
+        ("adopt a pet, please!", "thanks!", "time to restock", "help"),
+    ),
+    "rocket": (run_rocket, ("hello!",)),
+    "quantum": (run_quantum, ("hello!",)),
+}
+
+
+async def simulate(app, seconds, **world_args):
+    run, message_texts = APPS[app]
+    world = World(message_texts=message_texts, **world_args)
+    world.start()
+    task = asyncio.create_task(run(world))
+
+    started_at = time.perf_counter()
+    await asyncio.sleep(seconds)
+    await world.stop()
+    try:
+        await asyncio.wait_for(task, 10)
+    except asyncio.TimeoutError:
+        pass
+
+    elapsed = time.perf_counter() - started_at
+    stats = world.stats()
+    print(f"{app}: {stats['published']} entity updates in {elapsed:.1f}s")
+    print(f"World: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a bot in a simulated world.")
+    parser.add_argument("app", choices=sorted(APPS))
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--avatars", type=int, default=1000)
+    parser.add_argument("--moves", type=float, default=100, help="per second")
+    parser.add_argument("--messages", type=float, default=1, help="per second")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logs.configure()
+    asyncio.run(
+        simulate(
+            args.app,
+            args.seconds,
+            avatars=args.avatars,
+            moves_per_second=args.moves,
+            messages_per_second=args.messages,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            rate_limits=ratelimit.BUDGETS,
+            seed=args.seed,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Saving state to disk so that a restart can pick up where it left off.
+
+Snapshots are written to a temporary file which then replaces the old
+snapshot, so a crash mid-write leaves the previous snapshot intact.
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def save(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+        json.dump(data, snapshot_file, separators=(",", ":"), ensure_ascii=False)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+
+def load(path):
+    """
+    The saved snapshot, or None if there isn't a usable one.
+    """
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            return json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning("Ignoring unreadable snapshot %s", path)
+        return None
+
+
+async def save_in_background(path, data):
+    """
+    Write a snapshot without blocking the event loop. The data must not be
+    modified until this returns.
+    """
+    await asyncio.get_running_loop().run_in_executor(None, save, path, data)
+
+
+async def save_periodically(path, take_snapshot, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save_in_background(path, take_snapshot())
+        except OSError:
+            logger.exception("Failed to save snapshot %s", path)
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import random
+
+import pytest
+import websockets
+
+from actioncable.async_connection import AsyncConnection
+from actioncable import codec
+from actioncable.async_subscription import AsyncSubscription
+from actioncable.connection import Connection
+from actioncable.health import Backoff
+from actioncable.message import Message
+from actioncable.subscription import DROP_NEWEST, DROP_OLDEST, Subscription
+
+
+def subscribe(connection, identifier):
+    received = []
+    subscription = Subscription(connection, identifier)
+    subscription.on_receive(received.append)
+    return subscription, received
+
+
+def message(identifier, payload):
+    return json.dumps({"identifier": identifier, "message": payload})
+
+
+def test_routes_by_identifier_string():
+    connection = Connection("ws://localhost/cable")
+    chat, chat_received = subscribe(connection, {"channel": "ChatChannel"})
+    notes, notes_received = subscribe(connection, {"channel": "NotesChannel"})
+
+    connection._on_message(None, message(notes._identifier_string(), {"n": 1}))
+    connection._on_message(None, message(chat._identifier_string(), {"n": 2}))
+
+    assert notes_received == [{"n": 1}]
+    assert chat_received == [{"n": 2}]
+
+
+def test_routes_reformatted_identifier():
+    connection = Connection("ws://localhost/cable")
+    _, received = subscribe(connection, {"channel": "RoomChannel", "room": 1})
+
+    # The same identifier, with its keys reordered and without spaces.
+    identifier = '{"room":1,"channel":"RoomChannel"}'
+    connection._on_message(None, message(identifier, {"n": 1}))
+    connection._on_message(None, message(identifier, {"n": 2}))
+    connection._on_message(None, message('{"channel":"Unknown"}', {"n": 3}))
+    connection._on_message(None, message("not json", {"n": 4}))
+
+    assert received == [{"n": 1}, {"n": 2}]
+
+
+def test_confirm_subscription():
+    connection = Connection("ws://localhost/cable")
+    subscription, _ = subscribe(connection, {"channel": "ChatChannel"})
+
+    connection._on_message(
+        None,
+        json.dumps(
+            {
+                "identifier": subscription._identifier_string(),
+                "type": "confirm_subscription",
+            }
+        ),
+    )
+
+    assert subscription.state == "subscribed"
+    assert connection.find_subscription({"channel": "ChatChannel"}) is subscription
+
+
+class CableServer:
+    """
+    A stand-in ActionCable server: welcomes each client, confirms its
+    subscriptions, and records what it was sent.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.clients = []
+
+    async def handler(self, websocket, path=None):
+        self.clients.append(websocket)
+        await websocket.send(json.dumps({"type": "welcome"}))
+        async for message in websocket:
+            data = json.loads(message)
+            self.received.append(data)
+            if data["command"] == "subscribe":
+                await websocket.send(
+                    json.dumps(
+                        {
+                            "identifier": data["identifier"],
+                            "type": "confirm_subscription",
+                        }
+                    )
+                )
+
+    async def broadcast(self, identifier, message):
+        for client in self.clients:
+            await client.send(
+                json.dumps({"identifier": json.dumps(identifier), "message": message})
+            )
+
+
+async def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+@pytest.mark.asyncio
+async def test_async_connection():
+    cable = CableServer()
+    async with websockets.serve(cable.handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        connection = AsyncConnection(f"ws://127.0.0.1:{port}/cable")
+        chat = AsyncSubscription(connection, {"channel": "ChatChannel"})
+        notes = AsyncSubscription(connection, {"channel": "NotesChannel"})
+
+        async with connection:
+            await chat.create()
+            await notes.create()
+            await notes.send(Message("write", {"text": "hello"}))
+            await wait_for(lambda: notes.state == "subscribed")
+            await wait_for(lambda: chat.state == "subscribed")
+
+            await cable.broadcast({"channel": "NotesChannel"}, {"n": 1})
+            await cable.broadcast({"channel": "ChatChannel"}, {"n": 2})
+            await cable.broadcast({"channel": "NotesChannel"}, {"n": 3})
+
+            assert await notes.__anext__() == {"n": 1}
+            assert await notes.__anext__() == {"n": 3}
+            assert await chat.__anext__() == {"n": 2}
+
+            await chat.remove()
+            assert [message async for message in chat] == []
+            await wait_for(lambda: len(cable.received) == 4)
+
+    # Both subscriptions shared one socket.
+    assert len(cable.clients) == 1
+    assert [data["command"] for data in cable.received] == [
+        "subscribe",
+        "subscribe",
+        "message",
+        "unsubscribe",
+    ]
+    assert json.loads(cable.received[2]["data"]) == {
+        "text": "hello",
+        "action": "write",
+    }
+
+
+def installed_codecs():
+    for name in codec.CODECS:
+        try:
+            yield codec.load(name)
+        except ImportError:
+            pass
+
+
+@pytest.mark.parametrize("json_codec", list(installed_codecs()), ids=lambda c: c.name)
+def test_codec_frames(json_codec, monkeypatch):
+    monkeypatch.setattr(codec, "dumps", json_codec.dumps)
+    identifier = json_codec.dumps({"channel": "ChatChannel", "room": "é"})
+    data = Message("speak", {"text": 'say "hi"\n'}).raw_message()
+
+    prefix = codec.frame_prefix("message", identifier)
+    assert json.loads(codec.frame(prefix, data)) == {
+        "command": "message",
+        "identifier": identifier,
+        "data": data,
+    }
+    assert json.loads(codec.frame(codec.frame_prefix("subscribe", identifier))) == {
+        "command": "subscribe",
+        "identifier": identifier,
+    }
+    assert json_codec.loads(data) == {"text": 'say "hi"\n', "action": "speak"}
+    with pytest.raises(json_codec.DecodeError):
+        json_codec.loads("not json")
+
+
+def test_backoff():
+    backoff = Backoff(base=1, maximum=4, rng=random.Random(1))
+    delays = [backoff.next_delay() for _ in range(6)]
+    assert all(
+        0 <= delay <= ceiling for delay, ceiling in zip(delays, [1, 2, 4, 4, 4, 4])
+    )
+    assert len(set(delays)) == len(delays)
+
+    backoff.reset()
+    assert backoff.next_delay() <= 1
+
+
+@pytest.mark.parametrize("drop", [DROP_OLDEST, DROP_NEWEST])
+def test_message_queue_is_bounded(drop):
+    connection = Connection("ws://localhost/cable")
+    subscription = Subscription(
+        connection, {"channel": "ChatChannel"}, max_queue=2, drop=drop
+    )
+    subscription.create()
+    messages = [Message("speak", {"n": n}) for n in range(4)]
+    for message in messages:
+        subscription.send(message)
+
+    expected = messages[2:] if drop == DROP_OLDEST else messages[:2]
+    assert list(subscription.message_queue) == expected
+    assert subscription.dropped == 2
+    assert connection.health()["dropped"] == 2
+
+
+class FlakyCableServer(CableServer):
+    """
+    Drops its first client once it has confirmed its subscriptions.
+    """
+
+    async def handler(self, websocket, path=None):
+        first = not self.clients
+        self.clients.append(websocket)
+        await websocket.send(json.dumps({"type": "welcome"}))
+        async for message in websocket:
+            data = json.loads(message)
+            self.received.append(data)
+            await websocket.send(
+                json.dumps(
+                    {"identifier": data["identifier"], "type": "confirm_subscription"}
+                )
+            )
+            if first and len(self.received) == 2:
+                await websocket.close()
+
+
+@pytest.mark.asyncio
+async def test_async_connection_resubscribes():
+    cable = FlakyCableServer()
+    async with websockets.serve(cable.handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        connection = AsyncConnection(
+            f"ws://127.0.0.1:{port}/cable", backoff=Backoff(base=0.01)
+        )
+        subscriptions = [
+            AsyncSubscription(connection, {"channel": "ChatChannel", "room": n})
+            for n in range(2)
+        ]
+        for subscription in subscriptions:
+            await subscription.create()
+
+        async with connection:
+            await wait_for(lambda: len(cable.received) == 4)
+            await wait_for(lambda: all(s.state == "subscribed" for s in subscriptions))
+            health = connection.health()
+
+    assert len(cable.clients) == 2
+    assert [data["command"] for data in cable.received] == ["subscribe"] * 4
+    assert health["connects"] == 2
+    assert health["disconnects"] == 1
+    assert health["reconnect_attempts"] == 1
+    assert health["subscriptions"] == {"subscribed": 2}
+
+
+@pytest.mark.asyncio
+async def test_threaded_connection_resubscribes():
+    cable = FlakyCableServer()
+    async with websockets.serve(cable.handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        connection = Connection(
+            f"ws://127.0.0.1:{port}/cable", backoff=Backoff(base=0.01)
+        )
+        subscriptions = [
+            Subscription(connection, {"channel": "ChatChannel", "room": n})
+            for n in range(2)
+        ]
+        for subscription in subscriptions:
+            subscription.create()
+
+        connection.connect()
+        try:
+            await wait_for(lambda: len(cable.received) == 4)
+            await wait_for(lambda: all(s.state == "subscribed" for s in subscriptions))
+        finally:
+            # Closing waits for the server, which runs on this loop.
+            await asyncio.get_running_loop().run_in_executor(
+                None, connection.disconnect
+            )
+
+    assert connection.stats.disconnects >= 1
+    assert connection.stats.connects == 2
+
+
+@pytest.mark.asyncio
+async def test_threaded_connection_coalesces_writes():
+    cable = CableServer()
+    async with websockets.serve(cable.handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        connection = Connection(f"ws://127.0.0.1:{port}/cable", flush_interval=0.05)
+        subscription = Subscription(
+            connection, {"channel": "ChatChannel"}, max_queue=1000
+        )
+        subscription.create()
+        # Queued until subscribed, then replayed in a burst.
+        for n in range(200):
+            subscription.send(Message("speak", {"n": n}))
+
+        connection.connect()
+        try:
+            await wait_for(lambda: len(cable.received) == 201)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(
+                None, connection.disconnect
+            )
+
+    assert [json.loads(data["data"])["n"] for data in cable.received[1:]] == list(
+        range(200)
+    )
+    assert connection.stats.frames_sent == 201
+    assert connection.stats.writes < 20
@@ -0,0 +1,62 @@
+import pytest
+import rctogether
+
+import bulk
+import ratelimit
+
+bulk.RETRY_DELAY = 0.001
+ratelimit.limiter = ratelimit.RateLimiter({})
+
+
+class FlakySession:
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.requests = []
+
+    async def patch(self, path, bot_id, json):
+        return self.request("patch", bot_id, json)
+
+    async def delete(self, path, bot_id):
+        return self.request("delete", bot_id, None)
+
+    async def post(self, path, json):
+        return self.request("post", json["bot"]["name"], json)
+
+    def request(self, method, key, json):
+        self.requests.append((method, key))
+        if self.failures.get(key):
+            self.failures[key] -= 1
+            raise rctogether.api.HttpError(503, "Try again")
+        return {"id": key, "json": json}
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_retries_failures():
+    session = FlakySession({2: 1, 3: 10})
+    progress = []
+
+    report = await bulk.bulk_update(
+        session,
+        {bot_id: {"emoji": "👻"} for bot_id in range(5)},
+        progress=lambda report: progress.append(report.done),
+    )
+
+    assert sorted(report.results) == [0, 1, 2, 4]
+    assert report.results[2] == {"id": 2, "json": {"bot": {"emoji": "👻"}}}
+    assert list(report.failures) == [3]
+    assert session.requests.count(("patch", 3)) == bulk.ATTEMPTS
+    assert progress == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_and_create():
+    session = FlakySession({})
+
+    report = await bulk.bulk_delete(session, [7, 8])
+    assert sorted(report.results) == [7, 8]
+
+    report = await bulk.bulk_create(
+        session, [{"name": "cat", "emoji": "🐈", "x": 1, "y": 2}]
+    )
+    assert report.results[0]["id"] == "cat"
+    assert report.total == report.done == 1
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+import rctogether
+
+import flowcontrol
+
+
+def overload():
+    return rctogether.api.HttpError(503, "Service Unavailable")
+
+
+def test_circuit_opens_then_probes(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(flowcontrol.time, "monotonic", lambda: now[0])
+    breaker = flowcontrol.CircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure()
+    assert breaker.reserve() == 0
+    breaker.record_failure()
+    assert breaker.state == flowcontrol.OPEN
+    assert breaker.reserve() == 10
+
+    now[0] = 10
+    assert breaker.reserve() == 0
+    assert breaker.state == flowcontrol.HALF_OPEN
+    # Only one trial request at a time.
+    assert breaker.reserve() > 0
+
+    breaker.record_failure()
+    assert breaker.state == flowcontrol.OPEN
+
+    now[0] = 20
+    assert breaker.reserve() == 0
+    breaker.record_success()
+    assert breaker.state == flowcontrol.CLOSED
+    assert breaker.failures == 0
+
+
+def test_limit_backs_off_and_recovers():
+    controller = flowcontrol.FlowController(initial_limit=8, target_latency=1)
+
+    controller.in_flight = 3
+    controller.release(0.1, overload())
+    assert controller.limit == 4
+    # Responses to requests sent before the back off don't count again.
+    controller.release(0.1, overload())
+    assert controller.limit == 4
+
+    controller.release(0.1)
+    assert controller.limit == 4.25
+    assert controller.state()["overloaded"] == 2
+    assert controller.state()["circuit"] == flowcontrol.CLOSED
+
+
+def test_slow_responses_back_off():
+    controller = flowcontrol.FlowController(initial_limit=8, target_latency=1)
+
+    controller.in_flight = 1
+    controller.release(5)
+    assert controller.limit == 4
+    assert controller.latency == 5
+
+
+@pytest.mark.asyncio
+async def test_requests_wait_for_a_slot():
+    controller = flowcontrol.FlowController(initial_limit=2)
+    release = asyncio.Event()
+    running = []
+
+    async def request(n):
+        async with controller.request():
+            running.append(n)
+            await release.wait()
+
+    tasks = [asyncio.create_task(request(n)) for n in range(4)]
+    await asyncio.sleep(0.01)
+    assert running == [0, 1]
+    assert controller.state()["waiting"] == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert running == [0, 1, 2, 3]
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_errors_are_recorded_and_raised():
+    controller = flowcontrol.FlowController()
+
+    with pytest.raises(rctogether.api.HttpError):
+        async with controller.request():
+            raise overload()
+
+    assert controller.breaker.failures == 1
+    assert controller.in_flight == 0
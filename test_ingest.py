@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+import ingest
+
+
+def entity(entity_id, x):
+    return {"id": entity_id, "pos": {"x": x, "y": 0}}
+
+
+@pytest.mark.asyncio
+async def test_batches_are_fifo():
+    queue = ingest.EntityQueue(compact=False)
+    for x in range(5):
+        await queue.put(entity(x % 2, x))
+
+    assert [e["pos"]["x"] for e in await queue.get_batch(3)] == [0, 1, 2]
+    assert [e["pos"]["x"] for e in await queue.get_batch(3)] == [3, 4]
+    assert queue.stats()["max_depth"] == 5
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest():
+    queue = ingest.EntityQueue(maxsize=2, overflow=ingest.DROP_OLDEST)
+    for x in range(3):
+        await queue.put(entity(x, x))
+
+    assert [e["id"] for e in await queue.get_batch()] == [1, 2]
+    assert queue.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_drop_superseded_keeps_latest_state_per_entity():
+    queue = ingest.EntityQueue(
+        maxsize=3, overflow=ingest.DROP_SUPERSEDED, compact=False
+    )
+    await queue.put(entity("a", 1))
+    await queue.put(entity("b", 1))
+    await queue.put(entity("a", 2))
+    await queue.put(entity("c", 1))
+    await queue.put(entity("d", 1))
+
+    assert [(e["id"], e["pos"]["x"]) for e in await queue.get_batch()] == [
+        ("a", 2),
+        ("c", 1),
+        ("d", 1),
+    ]
+    assert queue.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_block_waits_for_space():
+    queue = ingest.EntityQueue(maxsize=1, overflow=ingest.BLOCK, compact=False)
+    await queue.put(entity("a", 1))
+
+    blocked = asyncio.create_task(queue.put(entity("a", 2)))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    assert [e["pos"]["x"] for e in await queue.get_batch()] == [1]
+    await blocked
+    assert [e["pos"]["x"] for e in await queue.get_batch()] == [2]
+    assert queue.dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_process_reads_while_handler_is_slow():
+    handled = []
+
+    async def source():
+        for x in range(10):
+            yield entity("a", x)
+            await asyncio.sleep(0)
+
+    async def handle_entities(batch):
+        await asyncio.sleep(0.01)
+        handled.append([e["pos"]["x"] for e in batch])
+
+    queue = await ingest.process(
+        source(), handle_entities, queue=ingest.EntityQueue(compact=False)
+    )
+
+    assert sum(handled, []) == list(range(10))
+    assert len(handled) < 10
+    assert queue.stats()["handled"] == 10
+
+
+@pytest.mark.asyncio
+async def test_process_survives_handler_errors():
+    async def source():
+        yield entity("a", 1)
+
+    async def handle_entities(batch):
+        raise ValueError("Oops")
+
+    queue = await ingest.process(source(), handle_entities)
+    assert queue.handled == 1
+
+
+@pytest.mark.asyncio
+async def test_backlog_compacts_to_latest_state_per_entity():
+    queue = ingest.EntityQueue()
+    for x in range(100):
+        await queue.put(entity("a", x))
+        await queue.put(dict(entity("b", x), person_name="Faker McFakeface"))
+
+    batch = await queue.get_batch()
+    assert batch == [
+        entity("a", 99),
+        dict(entity("b", 99), person_name="Faker McFakeface"),
+    ]
+    assert queue.compacted == 198
+
+
+@pytest.mark.asyncio
+async def test_compaction_keeps_messages():
+    queue = ingest.EntityQueue()
+    hello = {"text": "hello", "sent_at": "2022-07-01T12:00:00Z"}
+    goodbye = {"text": "goodbye", "sent_at": "2022-07-01T12:00:01Z"}
+
+    await queue.put(dict(entity("a", 1), message=hello))
+    await queue.put(entity("a", 2))
+    await queue.put(dict(entity("a", 3), message=goodbye))
+    await queue.put(dict(entity("a", 4), message=goodbye))
+
+    assert await queue.get_batch() == [
+        dict(entity("a", 2), message=hello),
+        dict(entity("a", 4), message=goodbye),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_compacted_process_catches_up():
+    handled = []
+
+    async def source():
+        for x in range(1000):
+            yield entity(x % 10, x)
+
+    async def handle_entities(batch):
+        await asyncio.sleep(0.01)
+        handled.extend(batch)
+
+    await ingest.process(source(), handle_entities)
+
+    assert len(handled) == 10
+    assert sorted(e["pos"]["x"] for e in handled) == list(range(990, 1000))
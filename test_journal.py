@@ -0,0 +1,29 @@
+import journal
+
+
+def test_segments_rotate_and_resume(tmp_path):
+    with journal.Journal(tmp_path, segment_bytes=100) as log:
+        for n in range(5):
+            log.append("tick", n=n)
+
+    assert len(journal.segment_paths(tmp_path)) > 1
+
+    with journal.Journal(tmp_path, segment_bytes=100) as log:
+        log.append("tick", n=5)
+
+    events = list(journal.read(tmp_path))
+    assert [event["n"] for event in events] == list(range(6))
+    assert [event["seq"] for event in events] == list(range(6))
+
+
+def test_torn_write_is_skipped(tmp_path):
+    with journal.Journal(tmp_path) as log:
+        log.append("tick", n=0)
+
+    with open(journal.segment_paths(tmp_path)[-1], "a", encoding="utf-8") as segment:
+        segment.write('{"seq": 1, "type": "ti')
+
+    with journal.Journal(tmp_path) as log:
+        log.append("tick", n=1)
+
+    assert [event["n"] for event in journal.read(tmp_path)] == [0, 1]
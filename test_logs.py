@@ -0,0 +1,86 @@
+import io
+import json
+import logging
+
+import pytest
+
+import logs
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    logs.shutdown()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_parse_levels():
+    assert logs.parse_levels("") == {}
+    assert logs.parse_levels("bot=debug, arctogether=WARNING,") == {
+        "bot": "DEBUG",
+        "arctogether": "WARNING",
+    }
+
+
+def test_sampling_filter():
+    sampling = logs.SamplingFilter()
+
+    def record(lineno, **extra):
+        record = logging.LogRecord(
+            "test", logging.INFO, "test.py", lineno, "", (), None
+        )
+        record.__dict__.update(extra)
+        return record
+
+    sampled = [sampling.filter(record(1, **logs.every(3))) for _ in range(7)]
+    assert sampled == [True, False, False, True, False, False, True]
+    # Call sites are counted separately, and unsampled records always pass.
+    assert sampling.filter(record(2, **logs.every(3)))
+    assert all(sampling.filter(record(1)) for _ in range(3))
+
+
+def test_configure(root_logger):
+    stream = io.StringIO()
+    logs.configure(
+        level="INFO", levels="chatty=ERROR", log_format="json", stream=stream
+    )
+
+    update = {"x": 1}
+    logging.getLogger("bot").info("Applying update: %s", update, extra={"bot_id": 7})
+    # The message is fixed when it is logged, not when it's written.
+    update["x"] = 2
+    logging.getLogger("bot").debug("Below the level")
+    logging.getLogger("chatty").warning("Below this module's level")
+    for _ in range(5):
+        logging.getLogger("bot").warning("Sampled", extra=logs.every(5))
+    logs.shutdown()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry["message"] for entry in entries] == [
+        "Applying update: {'x': 1}",
+        "Sampled",
+    ]
+    assert entries[0]["logger"] == "bot"
+    assert entries[0]["level"] == "INFO"
+    assert entries[0]["bot_id"] == 7
+    assert "sample_every" not in entries[1]
+
+
+def test_configure_text(root_logger):
+    stream = io.StringIO()
+    logs.configure(log_format="text", stream=stream)
+    try:
+        raise ValueError("oops")
+    except ValueError:
+        logging.getLogger("pets").exception("Failed")
+    logs.shutdown()
+
+    output = stream.getvalue()
+    assert " ERROR pets: Failed\n" in output
+    assert "ValueError: oops" in output
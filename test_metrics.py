@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import metrics
+
+
+def test_counter_labels():
+    registry = metrics.Registry()
+    counter = metrics.Counter("updates_total", "Updates.", ["event"], registry=registry)
+    counter.labels("sent").inc()
+    counter.labels("sent").inc(2)
+    counter.labels('say "hi"\n').inc()
+
+    assert registry.render() == (
+        "# HELP updates_total Updates.\n"
+        "# TYPE updates_total counter\n"
+        'updates_total{event="sent"} 3\n'
+        'updates_total{event="say \\"hi\\"\\n"} 1\n'
+    )
+
+
+def test_labels_are_checked():
+    counter = metrics.Counter(
+        "checked_total", "Checked.", ["a", "b"], registry=metrics.Registry()
+    )
+    with pytest.raises(ValueError):
+        counter.labels("only one")
+
+
+def test_gauge_function():
+    registry = metrics.Registry()
+    gauge = metrics.Gauge("depth", "Depth.", registry=registry)
+    items = [1, 2]
+    gauge.set_function(items.__len__)
+    items.append(3)
+
+    assert registry.render().endswith("depth 3\n")
+
+
+def test_histogram():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram(
+        "latency_seconds", "Latency.", registry=registry, buckets=(0.1, 1)
+    )
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_histogram_timer():
+    histogram = metrics.Histogram(
+        "timed_seconds", "Timed.", ["command"], registry=metrics.Registry()
+    )
+    with pytest.raises(RuntimeError):
+        with histogram.labels("adopt").time():
+            raise RuntimeError()
+
+    child = histogram.labels("adopt")
+    assert child.count == 1
+    assert child.sum >= 0
+
+
+@pytest.mark.asyncio
+async def test_serve():
+    registry = metrics.Registry()
+    metrics.Counter("served_total", "Served.", registry=registry).inc()
+    server = await metrics.serve(0, registry=registry)
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    try:
+        response = await get("/metrics")
+        assert response.startswith("HTTP/1.1 200 OK\r\n")
+        assert response.endswith("\r\n\r\n" + registry.render())
+        assert (await get("/")).startswith("HTTP/1.1 404")
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_serve_unconfigured():
+    assert await metrics.serve(None) is None
@@ -1,14 +1,24 @@
 from collections import namedtuple
 import asyncio
+import datetime
 import itertools
+import re
+import time
 
 import pytest
+import rctogether
 
 import pets
 import bot
+import journal
+import ratelimit
+import retry
 
-# Reduce the sleep delay in the bot update code so tests run faster.
+# Reduce the sleep delay in the bot update code and lift the rate limits so
+# tests run faster.
 bot.SLEEP_AFTER_UPDATE = 0.01
+ratelimit.limiter = ratelimit.RateLimiter({})
+retry.default_policy = retry.RetryPolicy(base_delay=0.01)
 pets.PET_BOREDOM_TIMES = (1, 1)
 
 Request = namedtuple("Request", ("method", "path", "id", "json"))
@@ -346,6 +356,24 @@ async def test_follow_owner(genie, owned_cat, person):
     assert pets.is_adjacent(person["pos"], await session.moved_to())
 
 
+@pytest.mark.asyncio
+async def test_follow_owner_batch(genie, owned_cat, person):
+    session = MockSession({"bots": [genie, owned_cat]})
+
+    async with await pets.Agency.create(session) as agency:
+        await agency.handle_entities(
+            [
+                dict(person, pos={"x": 50, "y": 45}),
+                {"type": "Bot", "id": owned_cat["id"], "pos": {"x": 2, "y": 2}},
+                dict(person, pos={"x": 70, "y": 12}),
+            ]
+        )
+
+    assert agency.pet_directory[owned_cat["id"]].pos == {"x": 2, "y": 2}
+    assert pets.is_adjacent({"x": 70, "y": 12}, await session.moved_to())
+    assert not session.pending_requests()
+
+
 @pytest.mark.asyncio
 async def test_ignores_unrelated_other(genie, owned_cat):
     session = MockSession({"bots": [genie]})
@@ -378,6 +406,39 @@ async def test_corral(owned_cat):
         await updates.__anext__()
 
 
+@pytest.mark.asyncio
+async def test_queued_updates_are_merged(rocket):
+    pet = pets.Pet(rocket)
+
+    await pet.update({"emoji": "💥", "name": "debris"})
+    await pet.update({"x": 2, "y": 3})
+    await pet.update({"x": 4, "y": 5})
+    await pet.update(None)
+
+    assert [update async for update in pet.queued_updates()] == [
+        {"emoji": "💥", "name": "debris", "x": 4, "y": 5}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_merges_updates(owned_cat):
+    session = MockSession({})
+    scheduler = bot.UpdateScheduler(session)
+    pet = pets.Pet(owned_cat)
+    pet.start_task(session, scheduler)
+
+    await pet.update({"x": 2, "y": 3})
+    await pet.update({"name": "Petless McPetface's cat"})
+    await pet.close()
+    await scheduler.close()
+
+    assert await session.moved_to() == {
+        "x": 2,
+        "y": 3,
+        "name": "Petless McPetface's cat",
+    }
+
+
 @pytest.mark.asyncio
 async def test_unowned_pets_dont_escape(rocket):
     pet = pets.Pet(rocket)
@@ -398,6 +459,212 @@ async def test_unowned_pets_dont_escape(rocket):
         await updates.__anext__()
 
 
+@pytest.mark.asyncio
+async def test_scheduler_sends_latest_update(owned_cat):
+    session = MockSession({})
+    scheduler = bot.UpdateScheduler(session)
+    pet = pets.Pet(owned_cat)
+    pet.start_task(session, scheduler)
+
+    await pet.update({"x": 2, "y": 3})
+    await pet.update({"x": 4, "y": 5})
+    await pet.update({"x": 6, "y": 7})
+    await pet.close()
+    await scheduler.close()
+
+    assert await session.moved_to() == {"x": 6, "y": 7}
+    assert not session.pending_requests()
+
+
+class FailOnceSession(MockSession):
+    def __init__(self, get_data):
+        super().__init__(get_data)
+        self.failed = asyncio.Event()
+
+    async def patch(self, path, bot_id, json):
+        if not self.failed.is_set():
+            self.failed.set()
+            raise rctogether.api.HttpError(503, "Service Unavailable")
+        await super().patch(path, bot_id, json)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_retries_beneath_newer_update(owned_cat):
+    session = FailOnceSession({})
+    scheduler = bot.UpdateScheduler(session)
+    pet = pets.Pet(owned_cat)
+    pet.start_task(session, scheduler)
+
+    await pet.update({"emoji": "💥", "x": 2, "y": 3})
+    await session.failed.wait()
+    await pet.update({"x": 4, "y": 5})
+    await pet.close()
+    await scheduler.close()
+
+    assert await session.moved_to() == {"emoji": "💥", "x": 4, "y": 5}
+    assert not session.pending_requests()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_corral(owned_cat, available_pets):
+    session = MockSession({})
+    scheduler = bot.UpdateScheduler(session)
+    owned_pet = pets.Pet(owned_cat)
+    owned_pet.start_task(session, scheduler)
+    unowned_pet = pets.Pet(available_pets[0])
+    unowned_pet.start_task(session, scheduler)
+
+    await asyncio.sleep(1.5)
+    await scheduler.close()
+
+    request = await session.get_request()
+    assert request.id == owned_cat["id"]
+    assert request.json["bot"] in pets.CORRAL
+    assert not session.pending_requests()
+
+
+def test_pet_directory_indexes(owned_cat, in_day_care_unicorn, rocket, person):
+    directory = pets.PetDirectory()
+    cat = pets.Pet(owned_cat)
+    unicorn = pets.Pet(in_day_care_unicorn)
+    available_rocket = pets.Pet(dict(rocket, id=5))
+    for pet in (cat, unicorn, available_rocket):
+        directory.add(pet)
+
+    assert directory.find_owned(person["id"], "cat") is cat
+    assert directory.find_owned(person["id"], "cat", True) is None
+    assert directory.find_owned(person["id"], "unicorn", True) is unicorn
+    assert directory.find_available("rocket") is available_rocket
+
+    directory.set_day_care(cat, True)
+    assert directory.find_owned(person["id"], "cat", False) is None
+    assert directory.find_owned(person["id"], "cat", True) is cat
+
+    directory.set_owner(available_rocket, person)
+    assert directory.find_available("rocket") is None
+    assert directory.find_owned(person["id"], "rocket") is available_rocket
+
+    directory.remove(unicorn)
+    assert directory.find_owned(person["id"], "unicorn") is None
+
+
+@pytest.mark.parametrize(
+    "pattern,prefixes",
+    [
+        ("time to restock", ["time to restock"]),
+        ("adopt (a|an|the)? ([A-Za-z-]+)", ["adopt "]),
+        ("(?:look after|drop off) my ([a-z]+)", ["look after", "drop off"]),
+        (r"well[- ]actually|subtle[- ]*ism", ["well", "subtle"]),
+        ("[A-Z]+ me", None),
+        ("help|.*please", None),
+    ],
+)
+def test_literal_prefixes(pattern, prefixes):
+    assert pets._literal_prefixes(pets.sre_parse.parse(pattern)) == prefixes
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Thanks! Could I adopt the cat please?",
+        "COLLECT MY UNICORN",
+        "I'd like to forget my cat",
+        "what a lovely day",
+        "pet the snail and give my owl to @**Bob**",
+        "Please help",
+    ],
+)
+def test_dispatcher_picks_first_command(text):
+    expected = next(
+        (
+            handler
+            for (pattern, handler, _) in pets.Agency.commands
+            if re.search(pattern, text, re.IGNORECASE)
+        ),
+        None,
+    )
+
+    command = pets.Agency.dispatcher.dispatch(text)
+    assert (command and command[1]) is expected
+
+
+def test_spatial_grid():
+    grid = pets.SpatialGrid(cell_size=4)
+    grid.add("in corral", "a", {"x": 3, "y": 45})
+    grid.add("on the edge", "b", {"x": 19, "y": 58})
+    grid.add("outside", "c", {"x": 20, "y": 40})
+    grid.add("moves", "d", {"x": 100, "y": 100})
+    grid.add("moves", "d", {"x": 4, "y": 44})
+
+    assert sorted(grid.in_region(pets.CORRAL)) == ["a", "b", "d"]
+    assert sorted(grid.near({"x": 3, "y": 44})) == ["a", "d"]
+    assert list(grid.near({"x": 100, "y": 100})) == []
+
+    grid.remove("in corral")
+    assert list(grid.near({"x": 2, "y": 46})) == []
+    assert len(grid) == 3
+
+
+@pytest.mark.asyncio
+async def test_snapshot_restore(
+    genie, owned_cat, in_day_care_unicorn, person, tmp_path
+):
+    path = tmp_path / "agency.json"
+    session = MockSession({"bots": [genie, owned_cat, in_day_care_unicorn]})
+
+    async with await pets.Agency.create(session, path) as agency:
+        await agency.handle_entity(person)
+        cat = agency.pet_directory[owned_cat["id"]]
+        agency.pet_directory.set_day_care(cat, True)
+        agency.lured_pets[cat.id] = time.time() + 60
+        agency.lured_pets_by_petter[person["id"]].append(cat)
+        watermark = agency.processed_message_dt = datetime.datetime(2022, 1, 1)
+
+    # The unicorn has been collected from day care since the snapshot.
+    in_day_care_unicorn["message"] = {
+        "mentioned_entity_ids": [person["id"]],
+        "text": "@**Faker McFaceface** 🦄",
+    }
+
+    async with await pets.Agency.create(session, path) as agency:
+        cat = agency.pet_directory[owned_cat["id"]]
+        assert cat.is_in_day_care_center
+        assert not agency.pet_directory[in_day_care_unicorn["id"]].is_in_day_care_center
+        assert cat.id in agency.lured_pets
+        assert agency.lured_pets_by_petter[person["id"]] == [cat]
+        assert agency.avatars[person["id"]]["person_name"] == person["person_name"]
+        assert agency.processed_message_dt == watermark
+
+
+@pytest.mark.asyncio
+async def test_journal_replay(genie, rocket, person, petless_person, tmp_path):
+    session = MockSession({"bots": [genie, rocket]})
+    messages = [
+        (person, genie, "adopt the rocket, please!"),
+        (person, [genie, petless_person], "give my rocket to"),
+        (petless_person, genie, "look after my rocket"),
+        (petless_person, genie, "time to restock"),
+    ]
+
+    with journal.Journal(tmp_path) as log:
+        async with await pets.Agency.create(session, journal=log) as agency:
+            await agency.handle_entity(petless_person)
+            for (minute, (sender, recipients, text)) in enumerate(messages):
+                entity = incoming_message(sender, recipients, text)
+                entity["message"]["sent_at"] = f"2037-12-31T23:{minute:02}:00Z"
+                await agency.handle_entity(entity)
+
+    replayed = pets.replay(journal.read(tmp_path))
+
+    (pet,) = replayed.owned(petless_person["id"])
+    assert pet.id == rocket["id"]
+    assert pet.name == "Petless McPetface's rocket"
+    assert pet.is_in_day_care_center
+    assert sorted(pet.id for pet in replayed.available()) == sorted(
+        pet.id for pet in agency.pet_directory.available()
+    )
+
+
 @pytest.mark.asyncio
 async def test_pet_a_pet(genie, owned_cat, petless_person, person):
     session = MockSession({"bots": [genie, owned_cat]})
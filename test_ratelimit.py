@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import pytest
+
+import ratelimit
+
+
+def test_burst_is_free():
+    bucket = ratelimit.TokenBucket(rate=10, burst=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+
+
+def test_callers_queue_behind_each_other():
+    bucket = ratelimit.TokenBucket(rate=10, burst=1)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_aggregate_rate_is_limited():
+    limiter = ratelimit.RateLimiter({"bots": (50, 5), "messages": (1, 1)})
+
+    start = time.monotonic()
+    await asyncio.gather(*[limiter.acquire("bots") for _ in range(10)])
+    elapsed = time.monotonic() - start
+
+    assert elapsed == pytest.approx(0.1, abs=0.05)
+
+
+@pytest.mark.asyncio
+async def test_unknown_endpoints_are_unlimited():
+    limiter = ratelimit.RateLimiter({})
+
+    await asyncio.wait_for(
+        asyncio.gather(*[limiter.acquire("walls") for _ in range(100)]), 0.1
+    )
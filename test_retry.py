@@ -0,0 +1,81 @@
+import asyncio
+import random
+
+import aiohttp
+import pytest
+import rctogether
+
+import retry
+
+
+class Failure(rctogether.api.HttpError):
+    def __init__(self, status, retry_after=None):
+        super().__init__(status, "")
+        self.retry_after = retry_after
+
+
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (rctogether.api.HttpError(429, ""), retry.RATE_LIMITED),
+        (rctogether.api.HttpError(502, ""), retry.SERVER_ERROR),
+        (aiohttp.ClientConnectionError(), retry.NETWORK_ERROR),
+        (asyncio.TimeoutError(), retry.NETWORK_ERROR),
+        (rctogether.api.HttpError(404, ""), None),
+        (ValueError(), None),
+    ],
+)
+def test_classify(exc, expected):
+    assert retry.classify(exc) == expected
+
+
+def test_backoff_grows_and_gives_up():
+    policy = retry.RetryPolicy(
+        rules={retry.SERVER_ERROR: 4}, base_delay=1, max_delay=3, rng=random.Random(1)
+    )
+    exc = Failure(500)
+
+    for attempt, cap in [(1, 1), (2, 2), (3, 3)]:
+        assert 0 <= policy.delay(exc, attempt) <= cap
+    assert policy.delay(exc, 4) is None
+    assert policy.delay(Failure(429), 1) is None
+
+
+def test_retry_after_is_honoured():
+    policy = retry.RetryPolicy(base_delay=0.5)
+
+    assert 10 <= policy.delay(Failure(429, retry_after=10), 1) <= 10.5
+
+
+def test_parse_retry_after():
+    assert retry.parse_retry_after("3") == 3
+    assert retry.parse_retry_after(None) is None
+    assert retry.parse_retry_after("soon") is None
+    assert retry.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+@pytest.mark.asyncio
+async def test_call_retries_until_success():
+    failures = [Failure(503), Failure(429, retry_after=0)]
+    policy = retry.RetryPolicy(base_delay=0.001)
+
+    async def request(value):
+        if failures:
+            raise failures.pop()
+        return value
+
+    assert await retry.call(request, "done", policy=policy) == "done"
+    assert not failures
+
+
+@pytest.mark.asyncio
+async def test_call_raises_unretryable_failures():
+    calls = []
+
+    async def request():
+        calls.append(None)
+        raise Failure(404)
+
+    with pytest.raises(Failure):
+        await retry.call(request)
+    assert len(calls) == 1
@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+
+import pytest
+import rctogether
+
+import ingest
+import pets
+import simulator
+
+
+@pytest.mark.asyncio
+async def test_rest_api():
+    world = simulator.World()
+
+    bot = await rctogether.bots.create(world, name="cat", emoji="🐈", x=1, y=2)
+    assert bot["pos"] == {"x": 1, "y": 2}
+
+    await rctogether.bots.update(world, bot["id"], {"x": 3, "name": "Bob's cat"})
+    (bot,) = await rctogether.bots.get(world)
+    assert bot["pos"] == {"x": 3, "y": 2}
+    assert bot["name"] == "Bob's cat"
+
+    await rctogether.bots.delete(world, bot["id"])
+    with pytest.raises(rctogether.api.HttpError) as exc_info:
+        await rctogether.bots.update(world, bot["id"], {"x": 4})
+    assert exc_info.value.args[0] == 404
+
+
+@pytest.mark.asyncio
+async def test_rate_limit():
+    world = simulator.World(rate_limits={"bots": (1, 2)})
+
+    await rctogether.bots.get(world)
+    await rctogether.bots.get(world)
+    with pytest.raises(simulator.HttpError) as exc_info:
+        await rctogether.bots.get(world)
+
+    assert exc_info.value.args[0] == 429
+    assert 0 < exc_info.value.retry_after <= 1
+    assert world.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_avatars_walk():
+    world = simulator.World(avatars=10, moves_per_second=1000, seed=1)
+    updates = world.entities()
+
+    assert len([await updates.__anext__() for _ in range(10)]) == 10
+
+    world.start()
+    entity = await asyncio.wait_for(updates.__anext__(), 1)
+    await world.stop()
+
+    assert entity["type"] == "Avatar"
+    assert 0 <= entity["pos"]["x"] < world.width
+
+
+@pytest.mark.asyncio
+async def test_agency_adopts_in_simulated_world():
+    world = simulator.World()
+    person = world.add_avatar("Faker McFakeface", {"x": 10, "y": 10})
+    cat = await rctogether.bots.create(world, name="cat", emoji="🐈", x=1, y=2)
+
+    async with await pets.Agency.create(world) as agency:
+        # Messages carry whole seconds; don't ignore one sent this second.
+        agency.processed_message_dt = datetime.datetime(2000, 1, 1)
+        task = asyncio.create_task(
+            ingest.process(world.entities(), agency.handle_entities)
+        )
+        world.say(person["id"], "adopt the cat, please!", [agency.genie.id])
+
+        for _ in range(100):
+            if world.entities_by_id[cat["id"]]["name"] != "cat":
+                break
+            await asyncio.sleep(0.01)
+
+        await world.stop()
+        await task
+
+    assert world.entities_by_id[cat["id"]]["name"] == "Faker McFakeface's cat"
+    assert world.entities_by_id[cat["id"]]["message"]["mentioned_entity_ids"] == [
+        person["id"]
+    ]
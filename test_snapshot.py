@@ -0,0 +1,19 @@
+import snapshot
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "state.json"
+
+    assert snapshot.load(path) is None
+
+    snapshot.save(path, {"pets": [1, 2]})
+    snapshot.save(path, {"pets": [3], "name": "🐈"})
+    assert snapshot.load(path) == {"pets": [3], "name": "🐈"}
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
+
+def test_unreadable_snapshot_is_ignored(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text('{"pets": [')
+
+    assert snapshot.load(path) is None